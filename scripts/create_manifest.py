@@ -10,13 +10,12 @@ def get_directory_files(directory: str) -> List[str]:
     Get all filenames in a directory excluding those starting with a dot.
     Returns filenames without extensions.
     """
-    files = []
-    for entry in os.scandir(directory):
-        if not entry.name.startswith('.'):
-            # Get filename without extension
-            filename = os.path.splitext(entry.name)[0]
-            files.append(filename)
-    return sorted(files)
+    # rpartition gives '' for names without an extension, so fall back to the name
+    return sorted(
+        name.rpartition('.')[0] or name
+        for name in os.listdir(directory)
+        if not name.startswith('.')
+    )
 
 def create_manifest_json(paths: List[str]) -> Dict[str, List[str]]:
     """
@@ -15,19 +15,19 @@ def process_data(input_path: Path, output_path: Path) -> None:
 
     isbn_map = {}
 
-    with open(input_path, 'r') as f:
-        xml_content = f.read()
-        root = ET.fromstring(xml_content)
+    # stream the XML and drop each group once it's been read
+    for _, group in ET.iterparse(input_path):
+        if group.tag != 'Group':
+            continue
 
-        for group in root.findall('.//Group'):
-            if all(int(rule.find('Length').text) == 0 for rule in group.findall('.//Rule')):
-                continue
-
-            prefix = normalize_isbn(group.find('Prefix').text)
-            agency = group.find('Agency').text
+        if not all(int(rule.findtext('Length')) == 0 for rule in group.iter('Rule')):
+            prefix = normalize_isbn(group.findtext('Prefix'))
+            agency = group.findtext('Agency')
 
             isbn_map[prefix] = agency
 
+        group.clear()
+
     with open(output_path, 'w') as f:
         json.dump(isbn_map, f, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
 
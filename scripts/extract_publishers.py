@@ -14,6 +14,8 @@ from tqdm import tqdm
 
 from common import normalize_isbn, read_zst_jsonl
 
+WRITE_BATCH_SIZE = 1_000_000
+
 def process_data(input_path: Path, output_path: Path, output2_path: Path) -> None:
     print(f"### Processing {input_path}")
 
@@ -34,7 +36,7 @@ def process_data(input_path: Path, output_path: Path, output2_path: Path) -> Non
                 if name is not None:
                     isbn_map[isbn].append(name)
                 else:
-                    isbn_map[isbn] = isbn_map[isbn]
+                    isbn_map.setdefault(isbn, [])
             elif isbn_type == 'isbn13':
                 isbn = normalize_isbn(isbn_data.get('isbn'), dashes=True)
                 # agency-publisher-rest
@@ -42,14 +44,16 @@ def process_data(input_path: Path, output_path: Path, output2_path: Path) -> Non
                 # unknown parent publisher
                 # isbn_map[isbn].append(name)
 
-                isbn_map[isbn] = isbn_map[isbn]
+                isbn_map.setdefault(isbn, [])
 
     chunk = {}
     size = 0
 
+    isbns = sorted(isbn_map)
+
     print(f"### Writing {output_path}")
 
-    for isbn in tqdm(sorted(isbn_map.keys())):
+    for isbn in tqdm(isbns):
         chunk[isbn] = isbn_map[isbn]
 
         size += len(isbn)
@@ -59,18 +63,20 @@ def process_data(input_path: Path, output_path: Path, output2_path: Path) -> Non
         if size > 100_000:
             first = next(iter(chunk))
             with open(output_path / f"{first}.json", 'w') as f:
-                json.dump(chunk, f, separators=(',', ':'), sort_keys=True)
+                # chunk is built from sorted keys already
+                json.dump(chunk, f, separators=(',', ':'))
 
             chunk = {}
             size = 0
 
     print(f"### Writing {output2_path}")
 
-    with open(output2_path, 'w', encoding='utf-8') as f:
-        for isbn in sorted(isbn_map.keys()):
-            f.write(f"{isbn}\n")
-        f.seek(f.tell() - 1)
-        f.truncate()
+    # write in batches of keys to bound the size of the joined payload
+    with open(output2_path, 'wb') as f:
+        for i in range(0, len(isbns), WRITE_BATCH_SIZE):
+            if i > 0:
+                f.write(b'\n')
+            f.write('\n'.join(isbns[i:i + WRITE_BATCH_SIZE]).encode('utf-8'))
 
     print(f"### Output written to {output_path} and {output2_path}")
 
@@ -1,46 +1,54 @@
 def filter_invalid_isbns(isbns):
     """
     Filter out invalid ISBNs based on prefix/base relationships.
+
+    Bases are always 9 digits, so prefix checks are done as set lookups
+    on fixed slices: isbn13[:9] for "starts with base" and isbn13[3:12]
+    for "starts with 978/979 + base".
     """
-    # Find ISBN-10s and their bases
-    isbn10s = {isbn for isbn in isbns if len(isbn) == 10}
+    # Split into ISBN-10s and ISBN-13s with and without the 978 prefix in one pass
+    isbn10s = set()
+    isbn13s_978 = set()
+    isbn13s_other = set()
+    for isbn in isbns:
+        if len(isbn) == 10:
+            isbn10s.add(isbn)
+        elif len(isbn) == 13:
+            if isbn.startswith('978'):
+                isbn13s_978.add(isbn)
+            else:
+                isbn13s_other.add(isbn)
+
+    # Find ISBN-10 bases
     bases = {isbn[:9] for isbn in isbn10s}
 
     # Find valid ISBN-13s that correspond to ISBN-10 bases
     valid_isbn13s = {
-        isbn13 for isbn13 in isbns
-        if len(isbn13) == 13
-        and any(isbn13.startswith('978' + base) for base in bases)
-    }
-
-    # Remove ISBN-13s that improperly start with a known base
-    remaining_isbn13s = {
-        isbn13 for isbn13 in isbns
-        if len(isbn13) == 13
-        and isbn13 not in valid_isbn13s
-        and not any(isbn13.startswith(base) for base in bases)
+        isbn13 for isbn13 in isbn13s_978
+        if isbn13[3:12] in bases
     }
 
-    # Find ISBN-13s that start with 978
+    # Remove ISBN-13s that improperly start with a known base,
+    # the remaining ones that start with 978 are kept
     isbns_978 = {
-        isbn13 for isbn13 in remaining_isbn13s
-        if isbn13.startswith('978')
+        isbn13 for isbn13 in isbn13s_978
+        if isbn13 not in valid_isbn13s
+        and isbn13[:9] not in bases
+    }
+    remaining_isbn13s = {
+        isbn13 for isbn13 in isbn13s_other
+        if isbn13[:9] not in bases
     }
 
     # add to bases
     bases |= {isbn13[3:12] for isbn13 in isbns_978}
 
-    # Remove ISBN-13s that improperly start with a known base (again)
-    remaining_isbn13s = {
-        isbn13 for isbn13 in remaining_isbn13s
-        if not any(isbn13.startswith(base) for base in bases)
-    }
-
-    # Find ISBN-13s that start with 979 and aren't a duplicate
+    # Find ISBN-13s that don't improperly start with a known base (again)
+    # and that don't duplicate a base under 979
     isbns_979 = {
         isbn13 for isbn13 in remaining_isbn13s
-        if isbn13 not in isbns_978
-        and not any(isbn13.startswith('979' + base) for base in bases)
+        if isbn13[:9] not in bases
+        and not (isbn13.startswith('979') and isbn13[3:12] in bases)
     }
 
     # Combine valid ISBNs
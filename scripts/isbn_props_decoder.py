@@ -1,6 +1,24 @@
 from dataclasses import dataclass
-from typing import List, Optional, Iterator, BinaryIO
+from typing import Generator, List, Optional, Iterator, BinaryIO
 import io
+import struct
+
+import numpy as np
+
+# big-endian ISBN position structs for every possible isbn_count (6 bits)
+_POSITIONS_STRUCTS = [struct.Struct(f'>{n}I') for n in range(64)]
+
+# start byte -> (has_count, has_year, record_size, positions struct)
+# record_size is the size of the remaining record data after the start byte
+_START_BYTES = [
+    (
+        bool(b & (1 << 7)),
+        bool(b & (1 << 6)),
+        (b >> 7) + ((b >> 6) & 1) + (b & 0x3F) * 4,
+        _POSITIONS_STRUCTS[b & 0x3F],
+    )
+    for b in range(256)
+]
 
 @dataclass
 class ISBNPropsRecord:
@@ -8,65 +26,52 @@ class ISBNPropsRecord:
     holdings_count: Optional[int]
     year: Optional[int]
 
-class ISBNPropsDecoder:
-    def decode_stream(self, stream: BinaryIO) -> Iterator[ISBNPropsRecord]:
-        """Decode a sequence of encoded records from a file-like object.
-
-        Args:
-            stream: A file-like object supporting read() method for reading bytes.
-                   This can be a file opened in binary mode, io.BytesIO, etc.
+@dataclass
+class ISBNPropsArrays:
+    """Records decoded into flat arrays, one entry per record except for isbn_positions.
 
-        Yields:
-            DecodedRecord objects containing the decoded data.
+    Missing holdings counts and years are -1. isbn_positions holds the
+    positions of all records back to back, isbn_counts[i] of them for record i.
+    """
+    holdings_counts: np.ndarray
+    years: np.ndarray
+    isbn_counts: np.ndarray
+    isbn_positions: np.ndarray
 
-        Raises:
-            ValueError: If the stream contains incomplete or invalid record data.
-            IOError: If there are issues reading from the stream.
-        """
-        while True:
-            # Read start byte
-            start_byte = stream.read(1)
-            if not start_byte:  # End of stream
-                break
+class ISBNPropsDecoder:
+    READ_SIZE = 1 << 20
 
-            start_byte = start_byte[0]
-            has_count = bool(start_byte & (1 << 7))
-            has_year = bool(start_byte & (1 << 6))
-            isbn_count = (start_byte & 0x3F)
+    def _decode_buffer(self, data: bytes | memoryview) -> Generator[ISBNPropsRecord, None, int]:
+        """Yield the complete records in a buffer and return the offset just past the last one."""
+        size = len(data)
+        pos = 0
 
-            # Calculate size of remaining record data
-            record_size = isbn_count * 4  # ISBN positions
-            if has_count:
-                record_size += 1
-            if has_year:
-                record_size += 1
+        while pos < size:
+            # Read start byte
+            has_count, has_year, record_size, positions_struct = _START_BYTES[data[pos]]
 
-            # Read the entire record data at once
-            record_data = stream.read(record_size)
-            if len(record_data) < record_size:
-                raise ValueError("Incomplete record data")
+            # Stop at a record that continues past the buffer
+            if pos + 1 + record_size > size:
+                break
 
-            pos = 0
+            pos += 1
 
             # Read holdings count if present
             holdings_count = None
             if has_count:
-                holdings_count = record_data[pos]
+                holdings_count = data[pos]
                 pos += 1
 
             # Read year if present
             year = None
             if has_year:
-                year_byte = record_data[pos]
+                year_byte = data[pos]
                 year = 2025 - year_byte
                 pos += 1
 
             # Read ISBN positions
-            isbn_positions = []
-            for _ in range(isbn_count):
-                position = int.from_bytes(record_data[pos:pos + 4], byteorder='big')
-                isbn_positions.append(position)
-                pos += 4
+            isbn_positions = list(positions_struct.unpack_from(data, pos))
+            pos += positions_struct.size
 
             yield ISBNPropsRecord(
                 isbn_positions=isbn_positions,
@@ -74,9 +79,93 @@ class ISBNPropsDecoder:
                 year=year
             )
 
+        return pos
+
+    def decode_stream(self, stream: BinaryIO) -> Iterator[ISBNPropsRecord]:
+        """Decode a sequence of encoded records from a file-like object.
+
+        The stream is read in large chunks, and a record split across two
+        chunks is carried over to the next one.
+
+        Args:
+            stream: A file-like object supporting read() method for reading bytes.
+                   This can be a file opened in binary mode, io.BytesIO, etc.
+
+        Yields:
+            DecodedRecord objects containing the decoded data.
+
+        Raises:
+            ValueError: If the stream contains incomplete or invalid record data.
+            IOError: If there are issues reading from the stream.
+        """
+        leftover = b''
+
+        while True:
+            chunk = stream.read(self.READ_SIZE)
+            if not chunk:  # End of stream
+                break
+
+            data = leftover + chunk if leftover else chunk
+            end = yield from self._decode_buffer(data)
+            leftover = data[end:]
+
+        if leftover:
+            raise ValueError("Incomplete record data")
+
     def decode_bytes(self, data: bytes) -> Iterator[ISBNPropsRecord]:
-        """Convenience method to decode from bytes using BytesIO."""
-        return self.decode_stream(io.BytesIO(data))
+        """Convenience method to decode directly from bytes."""
+        end = yield from self._decode_buffer(memoryview(data))
+        if end < len(data):
+            raise ValueError("Incomplete record data")
+
+    def decode_bytes_to_arrays(self, data: bytes) -> ISBNPropsArrays:
+        """Decode all records from bytes into flat numpy arrays.
+
+        Raises:
+            ValueError: If the data ends with an incomplete record.
+        """
+        size = len(data)
+
+        # The only sequential part: walk the start bytes to find each record
+        offsets = []
+        pos = 0
+        while pos < size:
+            offsets.append(pos)
+            pos += 1 + _START_BYTES[data[pos]][2]
+
+        if pos > size:
+            raise ValueError("Incomplete record data")
+
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        offsets = np.array(offsets, dtype=np.int64)
+        start_bytes = buffer[offsets]
+
+        has_count = (start_bytes & (1 << 7)) != 0
+        has_year = (start_bytes & (1 << 6)) != 0
+        isbn_counts = start_bytes & 0x3F
+
+        holdings_counts = np.full(len(offsets), -1, dtype=np.int16)
+        holdings_counts[has_count] = buffer[offsets[has_count] + 1]
+
+        year_offsets = offsets + 1 + has_count
+        years = np.full(len(offsets), -1, dtype=np.int16)
+        years[has_year] = 2025 - buffer[year_offsets[has_year]].astype(np.int16)
+
+        # Gather the 4 bytes of every ISBN position and read them as big-endian ints
+        counts = isbn_counts.astype(np.int64)
+        positions_starts = year_offsets + has_year
+        record_starts = np.repeat(positions_starts, counts)
+        first_index = np.repeat(np.cumsum(counts) - counts, counts)
+        byte_offsets = record_starts + (np.arange(len(record_starts)) - first_index) * 4
+        position_bytes = buffer[byte_offsets[:, np.newaxis] + np.arange(4)]
+        isbn_positions = position_bytes.view('>u4').ravel().astype(np.uint32)
+
+        return ISBNPropsArrays(
+            holdings_counts=holdings_counts,
+            years=years,
+            isbn_counts=isbn_counts,
+            isbn_positions=isbn_positions
+        )
 
 import unittest
 
@@ -141,6 +230,17 @@ class TestRecordDecoder(unittest.TestCase):
         self.assertEqual(records[1].year, 2015)
         self.assertEqual(records[1].isbn_positions, [2000])
 
+    def test_record_split_across_reads(self):
+        data = bytes([
+            0b11000001, 42, 5, 0, 0, 3, 232,
+            0b11000001, 100, 10, 0, 0, 7, 208
+        ])
+
+        self.decoder.READ_SIZE = 3
+        records = list(self.decoder.decode_stream(io.BytesIO(data)))
+        self.assertEqual([r.isbn_positions for r in records], [[1000], [2000]])
+        self.assertEqual([r.holdings_count for r in records], [42, 100])
+
     def test_incomplete_stream(self):
         data = bytes([
             0b11000001,  # Start byte
@@ -155,6 +255,22 @@ class TestRecordDecoder(unittest.TestCase):
 
         self.assertIn("Incomplete record data", str(context.exception))
 
+    def test_decode_bytes_to_arrays(self):
+        data = bytes([
+            0b11000001, 42, 5, 0, 0, 3, 232,            # all fields
+            0b01000010, 10, 0, 0, 7, 208, 0, 0, 0, 1,   # year only, two ISBNs
+            0b10000000, 0,                              # holdings only, no ISBNs
+        ])
+
+        arrays = self.decoder.decode_bytes_to_arrays(data)
+        self.assertEqual(arrays.holdings_counts.tolist(), [42, -1, 0])
+        self.assertEqual(arrays.years.tolist(), [2020, 2015, -1])
+        self.assertEqual(arrays.isbn_counts.tolist(), [1, 2, 0])
+        self.assertEqual(arrays.isbn_positions.tolist(), [1000, 2000, 1])
+
+        with self.assertRaises(ValueError):
+            self.decoder.decode_bytes_to_arrays(data[:-1])
+
     def test_empty_stream(self):
         stream = io.BytesIO(bytes([]))
         records = list(self.decoder.decode_stream(stream))
@@ -1,6 +1,7 @@
 from pathlib import Path
+import numpy as np
 from PIL import Image
-from common import HEIGHT, WIDTH, get_pos
+from common import HEIGHT, WIDTH, get_pos, get_pos_array
 
 
 def get_plot_pos(isbn: str) -> tuple[int, int]:
@@ -9,14 +10,22 @@ def get_plot_pos(isbn: str) -> tuple[int, int]:
 
     return x // w, y // h
 
+def get_plot_pos_array(codes: np.ndarray, length: int) -> tuple[np.ndarray, np.ndarray]:
+    xs, ys = get_pos_array(codes, length)
+    w, h = get_pos('00' + '0' * (length - 4) + '11')
+
+    return xs // w, ys // h
+
 def init_plots():
     image_dims = [(WIDTH // 10 ** ((i + 2) // 2), HEIGHT // 10 ** ((i + 1) // 2)) for i in range(6)]
     image_dims.reverse()
 
-    return [Image.new('1', (w, h)) for w, h in image_dims]
+    # plots are indexed [y, x] and only turned into images on save
+    return [np.zeros((h, w), dtype=bool) for w, h in image_dims]
 
-def save_plots(images: list[Image.Image], output_path: Path):
-    for i, image in enumerate(images):
+def save_plots(images: list[np.ndarray], output_path: Path):
+    for i, plot in enumerate(images):
+        image = Image.fromarray(plot)
         image.save(output_path / f"{i}.png", optimize=True, compress_level=9)
 
         # for better PNG compression, store in landscape orientation
@@ -2,31 +2,33 @@
 Takes a json file of agencies and generates a PNG of agency ranges
 """
 
-from PIL import Image, ImageDraw
+from PIL import Image
+import numpy as np
 import json
 import argparse
 from pathlib import Path
 
-from plot import init_plots
 from common import HEIGHT, WIDTH, get_pos
 
 def process_data(input_path: Path, output_path: Path) -> None:
     print(f"### Processing {input_path}")
 
-    image = Image.new('1', (WIDTH // 100, HEIGHT // 100))
+    image = np.zeros((HEIGHT // 100, WIDTH // 100), dtype=bool)
+
+    # range size only depends on prefix length
+    sizes = {2: (10_000, 10_000)}
 
     with input_path.open() as f:
         data = json.load(f)
         for prefix in data.keys():
             x, y = get_pos(prefix)
-            if len(prefix) == 2:
-                w, h = (10_000, 10_000)
-            else:
-                w, h = get_pos('0' * (len(prefix) - 2) + '11')
+            if len(prefix) not in sizes:
+                sizes[len(prefix)] = get_pos('0' * (len(prefix) - 2) + '11')
+            w, h = sizes[len(prefix)]
 
-            ImageDraw.Draw(image).rectangle([x // 100, y // 100, (x+w) // 100 - 1, (y+h) // 100 - 1], fill=1)
+            image[y // 100:(y+h) // 100, x // 100:(x+w) // 100] = True
 
-    image.save(output_path, optimize=True, compress_level=9)
+    Image.fromarray(image).save(output_path, optimize=True, compress_level=9)
 
     print(f"### Output written to {output_path}")
 
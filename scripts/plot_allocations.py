@@ -5,48 +5,46 @@ Takes an XML of ISBN ranges and generates PNGs of publisher allocation ranges
 import argparse
 from pathlib import Path
 import xml.etree.ElementTree as ET
+import numpy as np
 from tqdm import tqdm
 
 from common import normalize_isbn
-from plot import get_plot_pos, init_plots, save_plots
+from plot import get_plot_pos_array, init_plots, save_plots
 
 def process_data(input_path: Path, output_path: Path) -> None:
     print(f"### Processing {input_path}")
 
     images = init_plots()
 
-    with open(input_path, 'r') as f:
-        xml_content = f.read()
-        root = ET.fromstring(xml_content)
+    # progress through the file, the rules aren't known until they are streamed
+    pbar = tqdm(total=input_path.stat().st_size, unit='B', unit_scale=True)
 
-        total_rules = 0
-        for rule in root.find('RegistrationGroups').findall('.//Rule'):
-            if int(rule.find('Length').text) > 0:
-                total_rules += 1
+    with open(input_path, 'rb') as f:
+        # stream the XML and drop each group once it's been plotted
+        for _, group in ET.iterparse(f):
+            if group.tag != 'Group':
+                continue
 
-        pbar = tqdm(total=total_rules)
+            prefix = normalize_isbn(group.findtext('Prefix'))
 
-        for group in root.findall('.//Group'):
-            prefix = normalize_isbn(group.find('Prefix').text)
-
-            for rule in group.findall('.//Rule'):
-                length = int(rule.find('Length').text)
+            for rule in group.iter('Rule'):
+                length = int(rule.findtext('Length'))
                 if length == 0:
                     continue
 
-                range_text = rule.find('Range').text
+                range_text = rule.findtext('Range')
                 size = len(prefix) + length
                 [start, end] = [int(prefix + s[:length]) for s in range_text.split('-')]
 
                 image = images[size - 4]
 
-                for i in range(start, end + 1):
-                    isbn = str(i).rjust(size, '0')
-                    image.putpixel(get_plot_pos(isbn), 1)
+                xs, ys = get_plot_pos_array(np.arange(start, end + 1, dtype=np.int64), size)
+                image[ys, xs] = True
 
-                pbar.update(1)
+            group.clear()
+            pbar.update(f.tell() - pbar.n)
 
-        pbar.close()
+    pbar.close()
 
     save_plots(images, output_path)
     print(f"### Outputs written to {output_path}")
@@ -3,25 +3,30 @@ Takes a text file of publisher ISBN prefixes and generates PNGs of publisher ran
 """
 
 import argparse
+from collections import defaultdict
 from pathlib import Path
+import numpy as np
 from tqdm import tqdm
 
-from plot import get_plot_pos, init_plots, save_plots
+from plot import get_plot_pos_array, init_plots, save_plots
 
 def process_data(input_path: Path, output_path: Path) -> None:
     print(f"### Processing {input_path}")
 
     images = init_plots()
 
+    # group prefixes by length so each plot is written in one go
+    isbns_by_size = defaultdict(list)
+
     with open(input_path, 'r', encoding='utf-8') as f:
         lines = [*f]
         for line in tqdm(lines):
             isbn = line.strip()
-            size = len(isbn)
-
-            x, y = get_plot_pos(isbn)
+            isbns_by_size[len(isbn)].append(int(isbn))
 
-            images[size - 4].putpixel((x, y), 1)
+    for size, isbns in isbns_by_size.items():
+        xs, ys = get_plot_pos_array(np.array(isbns, dtype=np.int64), size)
+        images[size - 4][ys, xs] = True
 
     save_plots(images, output_path)
     print(f"### Outputs written to {output_path}")
@@ -1,11 +1,31 @@
+from functools import lru_cache
 import json
-from typing import Optional, Set
-import struct
+from operator import mul
+from typing import Iterable, Iterator, Optional, Set
 import re
 
+import numpy as np
+
 from isbn_filter import filter_invalid_isbns
 from processor_most_likely_year import extract_most_likely_year
 
+# checksum weights, applied to the ASCII codes of the digits in one C-level pass
+ISBN10_WEIGHTS = (10, 9, 8, 7, 6, 5, 4, 3, 2)
+ISBN13_WEIGHTS = (1, 3) * 6 + (1,)
+ISBN10_ASCII_OFFSET = ord('0') * sum(ISBN10_WEIGHTS)
+ISBN13_ASCII_OFFSET = ord('0') * sum(ISBN13_WEIGHTS)
+# value of an ISBN-10 check digit, anything missing is invalid
+ISBN10_CHECK_DIGITS = {**{str(i): i for i in range(10)}, 'X': 10}
+
+ISBN_SEPARATORS = str.maketrans('', '', '- ')
+
+def sum_weighted(values, weights):
+    return sum(map(mul, values, weights))
+
+# the same ISBNs turn up over and over across records
+ISBN_CACHE_SIZE = 1 << 20
+
+@lru_cache(maxsize=ISBN_CACHE_SIZE)
 def verify_isbn(isbn):
     """
     Verify ISBN-10 or ISBN-13 checksum.
@@ -14,36 +34,70 @@ def verify_isbn(isbn):
     # Remove any hyphens and spaces
     isbn = isbn.replace('-', '').replace(' ', '')
 
+    if not isbn.isascii():
+        return False
+
     # Determine ISBN type based on length
     if len(isbn) == 10:
         # ISBN-10 verification
-        if not isbn[:-1].isdigit() or isbn[-1] not in '0123456789X':
+        last = ISBN10_CHECK_DIGITS.get(isbn[-1])
+        if last is None or not isbn[:-1].isdigit():
             return False
 
-        sum = 0
-        for i in range(9):
-            sum += int(isbn[i]) * (10 - i)
-
-        last = 10 if isbn[-1] == 'X' else int(isbn[-1])
+        sum = sum_weighted(isbn[:-1].encode(), ISBN10_WEIGHTS) - ISBN10_ASCII_OFFSET
         sum += last
 
         return sum % 11 == 0
 
     elif len(isbn) == 13:
-        # ISBN-13 verification
+        # ISBN-13 verification, check digit has weight 1 so the total must be a multiple of 10
         if not isbn.isdigit():
             return False
 
-        sum = 0
-        for i in range(12):
-            sum += int(isbn[i]) * (1 if i % 2 == 0 else 3)
-
-        check_digit = (10 - (sum % 10)) % 10
-        return check_digit == int(isbn[-1])
+        sum = sum_weighted(isbn.encode(), ISBN13_WEIGHTS) - ISBN13_ASCII_OFFSET
+        return sum % 10 == 0
 
     else:
         return False
 
+@lru_cache(maxsize=ISBN_CACHE_SIZE)
+def get_isbn_position(isbn: str) -> Optional[int]:
+    """Convert ISBN to position number.
+
+    Args:
+        isbn: ISBN string (10 or 13 digits with optional hyphens)
+
+    Returns:
+        Integer position or None if invalid
+    """
+    if not isbn or not isinstance(isbn, str):
+        return None
+
+    # cheap path for the usual separators, the regex handles anything else
+    digits = isbn.translate(ISBN_SEPARATORS)
+    if not (digits.isascii() and digits.isdigit()):
+        digits = re.sub(r'[^0-9]', '', isbn)
+
+    base = digits[:-1]
+    if not base:
+        return None
+
+    if len(base) < 12:
+        base = '978' + base
+
+    try:
+        position = int(base[-12:]) - 978_000_000_000
+        if 0 <= position < 2**32:
+            # prefix = position // 100_000_000
+            # if prefix not in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 18]:
+            #     print('bruh')
+            #     print(isbn)
+            #     print(json.dumps(self.records, indent=2, ensure_ascii=False))
+            return position
+    except ValueError:
+        pass
+    return None
+
 class DataHandler:
     """Handles processing of book records and converts them to a compact byte format.
 
@@ -60,8 +114,21 @@ class DataHandler:
     BASE_ISBN = 978000000000
     MAX_CHUNK_SIZE = 15
 
+    HOLDINGS_FIELDS = ('totalHoldingCount', 'total_holding_count')
+    YEAR_FIELDS = ('machineReadableDate', 'publicationDate', 'date')
+
+    # start byte of a chunk, indexed by [has_count][has_year][isbn_count]
+    _START_BYTES = [
+        [
+            [bytes([(has_count << 7) | (has_year << 6) | (isbn_count & 0x0F)]) for isbn_count in range(16)]
+            for has_year in (0, 1)
+        ]
+        for has_count in (0, 1)
+    ]
+
     def __init__(self):
         self.current_id: Optional[str] = None
+        # verified ISBNs of the current record
         self.isbns: Set[str] = set()
         # self.isbn_positions: Set[int] = set()
         self.holdings_count: Optional[int] = None
@@ -71,36 +138,8 @@ class DataHandler:
         self.records = []
 
     def _get_isbn_position(self, isbn: str) -> Optional[int]:
-        """Convert ISBN to position number.
-
-        Args:
-            isbn: ISBN string (10 or 13 digits with optional hyphens)
-
-        Returns:
-            Integer position or None if invalid
-        """
-        if not isbn or not isinstance(isbn, str):
-            return None
-
-        base = re.sub(r'[^0-9]', '', isbn)[:-1]
-        if not base:
-            return None
-
-        if len(base) < 12:
-            base = '978' + base
-
-        try:
-            position = int(base[-12:]) - 978_000_000_000
-            if 0 <= position < 2**32:
-                # prefix = position // 100_000_000
-                # if prefix not in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 18]:
-                #     print('bruh')
-                #     print(isbn)
-                #     print(json.dumps(self.records, indent=2, ensure_ascii=False))
-                return position
-        except ValueError:
-            pass
-        return None
+        """Convert ISBN to position number, see get_isbn_position."""
+        return get_isbn_position(isbn)
 
     def _reset_state(self) -> None:
         """Reset all state variables to initial values."""
@@ -112,6 +151,25 @@ class DataHandler:
 
         self.records.clear()
 
+    def _iter_isbn_positions(self, isbns: Iterable[str]) -> Iterator[int]:
+        """Yield the raw positions of verified and filtered ISBNs, skipping invalid ones."""
+        for isbn in isbns:
+            # verified and filtered ISBNs are almost always bare digits,
+            # so the position can be sliced out directly
+            is_bare = isbn.isascii() and isbn.isdigit()
+            if is_bare and len(isbn) == 13:
+                pos = int(isbn[:12]) - self.BASE_ISBN
+                if not 0 <= pos < 2**32:
+                    continue
+            elif is_bare and len(isbn) == 10:
+                pos = int(isbn[:9])
+            else:
+                pos = self._get_isbn_position(isbn)
+                if pos is None:
+                    continue
+
+            yield pos
+
     def _create_bytes(self) -> Optional[bytes]:
         """Create bytes from current state."""
 
@@ -122,35 +180,19 @@ class DataHandler:
         if not self.isbns:
             return None
 
-        isbns = filter_invalid_isbns({isbn for isbn in self.isbns if verify_isbn(isbn)})
-        diff = {isbn for isbn in self.isbns if isbn not in isbns}
-        # if diff:
-        #     print([*isbns], [*diff])
-
-        isbn_positions = set()
-
-        # has_likely_error = False
-        for isbn in isbns:
-            pos = self._get_isbn_position(isbn)
-
-            if pos is not None:
-                if pos >= 1_000_000_000 and \
-                    not (pos >= 1_100_000_000 and pos < 1_140_000_000) and \
-                    not (pos >= 1_800_000_000 and pos < 1_900_000_000):
-                    # sometimes they get prefixed with 979 when they're actually under 978
-                    # assume that's the case and fix it
-                    pos -= 1_000_000_000
-                    # has_likely_error = True
-                    # continue
-
-                isbn_positions.add(pos)
+        isbns = filter_invalid_isbns(self.isbns)
 
-        # if has_likely_error:
-        #     print("likely error", self.isbns)
-        #     print(json.dumps(self.records, indent=2, ensure_ascii=False))
+        isbn_positions = np.fromiter(self._iter_isbn_positions(isbns), dtype=np.uint32)
 
+        # sometimes they get prefixed with 979 when they're actually under 978
+        # assume that's the case and fix it for the whole record at once
+        prefixed_979 = (isbn_positions >= 1_000_000_000) & \
+            ~((isbn_positions >= 1_100_000_000) & (isbn_positions < 1_140_000_000)) & \
+            ~((isbn_positions >= 1_800_000_000) & (isbn_positions < 1_900_000_000))
+        isbn_positions -= prefixed_979.astype(np.uint32) * np.uint32(1_000_000_000)
 
-        isbn_positions = sorted(isbn_positions)
+        # sorted and deduplicated
+        isbn_positions = np.unique(isbn_positions)
         has_count = self.holdings_count is not None
         has_year = self.year is not None
 
@@ -168,28 +210,23 @@ class DataHandler:
             #         print(generalFormat, specificFormat)
             # print(json.dumps(self.records, indent=2, ensure_ascii=False))
 
-        all_chunks = []
-        for i in range(0, len(isbn_positions), self.MAX_CHUNK_SIZE):
-            chunk = isbn_positions[i:i + self.MAX_CHUNK_SIZE]
-            isbn_count = len(chunk)
-
-            start_byte = ((1 if has_count else 0) << 7) | \
-                        ((1 if has_year else 0) << 6) | \
-                        (isbn_count & 0x0F)
+        # serialize all positions as big-endian 32-bit ints at once, chunks take slices of it
+        positions_bytes = isbn_positions.astype('>u4').tobytes()
 
-            chunk_bytes = bytearray([start_byte])
+        # holdings and year bytes are the same for every chunk
+        header = b''
+        if has_count:
+            header += bytes([min(255, max(0, self.holdings_count))])
+        if has_year:
+            header += bytes([min(255, max(0, 2025 - self.year))])
+        start_bytes = self._START_BYTES[has_count][has_year]
 
-            if has_count:
-                holdings_byte = min(255, max(0, self.holdings_count))
-                chunk_bytes.append(holdings_byte)
-            if has_year:
-                year_byte = min(255, max(0, 2025 - self.year))
-                chunk_bytes.append(year_byte)
-
-            for position in chunk:
-                chunk_bytes.extend(struct.pack('>I', position))
-
-            all_chunks.append(bytes(chunk_bytes))
+        all_chunks = []
+        for i in range(0, len(isbn_positions), self.MAX_CHUNK_SIZE):
+            isbn_count = min(self.MAX_CHUNK_SIZE, len(isbn_positions) - i)
+            all_chunks.append(start_bytes[isbn_count])
+            all_chunks.append(header)
+            all_chunks.append(positions_bytes[i * 4:(i + isbn_count) * 4])
 
         return b''.join(all_chunks) if all_chunks else None
 
@@ -228,13 +265,16 @@ class DataHandler:
 
         # Process and merge ISBNs
         isbns = set()
-        if 'isbns' in record and record['isbns']:
-            isbns.update(record['isbns'])
+        record_isbns = record.get('isbns')
+        if record_isbns:
+            isbns.update(record_isbns)
 
-        if 'isbn13' in record and record['isbn13']:
-            isbns.add(record['isbn13'])
+        isbn13 = record.get('isbn13')
+        if isbn13:
+            isbns.add(isbn13)
 
-        self.isbns.update(isbns)
+        # only valid ISBNs are kept, so _create_bytes doesn't have to check them again
+        self.isbns.update(filter(verify_isbn, isbns))
 
         # has_likely_error = False
         # for isbn in isbns:
@@ -264,17 +304,19 @@ class DataHandler:
         #     print("likely error", isbns)
 
         # Update holdings count (take max)
-        holdings_fields = ['totalHoldingCount', 'total_holding_count']
-        for field in holdings_fields:
-            if field in record:
-                if self.holdings_count is None:
-                    self.holdings_count = record[field]
-                else:
-                    self.holdings_count = max(self.holdings_count, record[field])
+        for field in self.HOLDINGS_FIELDS:
+            holdings_count = record.get(field)
+            if holdings_count is None:
+                continue
+            if self.holdings_count is None:
+                self.holdings_count = holdings_count
+            else:
+                self.holdings_count = max(self.holdings_count, holdings_count)
 
         # Update year (take min)
-        year_fields = ['machineReadableDate', 'publicationDate', 'date']
-        new_year = extract_most_likely_year([record.get(field) for field in year_fields if field in record])
+        new_year = extract_most_likely_year(
+            [value for field in self.YEAR_FIELDS if (value := record.get(field)) is not None]
+        )
         if new_year:
             if self.year is None:
                 self.year = new_year
@@ -8,7 +8,21 @@ from typing import Optional
 from multiprocessing import Process, Queue, Event, cpu_count
 import queue  # for queue exceptions
 from tqdm import tqdm
-from processor_worker import Worker, ProgressUpdate, DataHandler, SplitFinder
+from processor_worker import Worker, ProgressUpdate, SplitFinder
+from processor_ring_buffer import RingBuffer
+
+# results are gathered until there's this many bytes, then written with one syscall
+WRITE_BATCH_SIZE = 1 << 20
+# IOV_MAX on Linux, the most buffers a single writev takes
+WRITEV_MAX_BUFFERS = 1024
+
+def run_worker(worker_id: int, start: tuple[int, str], end: tuple[int, str], input_path: str,
+               result_ring: RingBuffer, progress_queue: Queue, stop_event: Event):
+    """Process target that releases the worker's view of its result ring once it's done"""
+    try:
+        Worker.run_worker(worker_id, start, end, input_path, result_ring, progress_queue, stop_event)
+    finally:
+        result_ring.close()
 
 def process_file(input_path: str, output_path: str, num_workers: Optional[int] = None):
     if num_workers is None:
@@ -29,8 +43,9 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
     finder = SplitFinder(input_path)
     split_points = finder.find_split_points(num_workers)
 
-    # Create queues - use multiprocessing queues
-    result_queue = Queue()
+    # Results go through a shared memory ring per worker to avoid pickling,
+    # progress updates are rare enough for a multiprocessing queue
+    result_rings = [RingBuffer() for _ in range(num_workers)]
     progress_queue = Queue()
 
     # For clean shutdown
@@ -57,40 +72,47 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
                 except:
                     pass
 
+        for ring in result_rings:
+            ring.unlink()
+
         sys.exit(1)  # Exit immediately after termination
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    # Create and start workers as processes
+    # Create and start workers as processes, each pinned to its own core where
+    # supported so the scheduler doesn't move them away from warm caches
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_setaffinity') else []
     workers = []
     for i in range(num_workers):
         start = split_points[i-1] if i > 0 else (0, '')
         end = split_points[i] if i < len(split_points) else (finder.file_size + 1, '')
         worker = Process(
-            target=Worker.run_worker,
+            target=run_worker,
             args=(
                 i,
                 start,
                 end,
                 input_path,
-                result_queue,
+                result_rings[i],
                 progress_queue,
-                DataHandler(),
                 stop_event
             )
         )
         workers.append(worker)
         worker.start()
+        if cpus:
+            os.sched_setaffinity(worker.pid, {cpus[i % len(cpus)]})
 
     # Initialize progress tracking
     progress = {i: 0 for i in range(num_workers)}
     pbar = tqdm(total=total_size, unit='B', unit_scale=True)
 
     # Monitor progress and write results
+    workers_done = threading.Event()
     result_writer = threading.Thread(
         target=write_results,
-        args=(result_queue, output_path)
+        args=(result_rings, workers_done, output_path)
     )
     result_writer.start()
 
@@ -98,26 +120,32 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
     total_results = 0
 
     while any(worker.is_alive() for worker in workers):
+        # block for the first update, then take whatever else has piled up
         try:
-            update: ProgressUpdate = progress_queue.get(timeout=0.1)
+            updates: list[ProgressUpdate] = [progress_queue.get(timeout=0.1)]
         except (EOFError, queue.Empty):
             # print('no progress')
             continue
+        while True:
+            try:
+                updates.append(progress_queue.get_nowait())
+            except (EOFError, queue.Empty):
+                break
 
-        worker = workers[update.worker_id]
-        worker_start = split_points[update.worker_id-1][0] if update.worker_id > 0 else 0
-        worker_end = split_points[update.worker_id][0] if update.worker_id < len(split_points) else total_size
-
-        # Cap progress at worker's assigned range
-        new_progress = min(update.compressed_bytes, worker_end - worker_start)
-        old_progress = progress[update.worker_id]
-        progress[update.worker_id] = new_progress
+        progress_delta = 0
+        for update in updates:
+            worker_start = split_points[update.worker_id-1][0] if update.worker_id > 0 else 0
+            worker_end = split_points[update.worker_id][0] if update.worker_id < len(split_points) else total_size
 
+            # Cap progress at worker's assigned range
+            new_progress = min(update.compressed_bytes, worker_end - worker_start)
+            progress_delta += new_progress - progress[update.worker_id]
+            progress[update.worker_id] = new_progress
 
-        pbar.update(new_progress - old_progress)
+            total_uncompressed += update.uncompressed_bytes
+            total_results += update.num_entries
 
-        total_uncompressed += update.uncompressed_bytes
-        total_results += update.num_entries
+        pbar.update(progress_delta)
 
     pbar.close()
 
@@ -128,37 +156,73 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
         if worker.is_alive():
             worker.terminate()
 
-    result_queue.put(None)  # Signal writer to stop
+    workers_done.set()  # Signal writer to drain the rings and stop
     result_writer.join()
     # Thread doesn't need terminate() - join is sufficient
 
+    for ring in result_rings:
+        ring.close()
+        ring.unlink()
+
     # Print completion statistics
     print("\nProcessing complete!")
     print(f"Uncompressed data processed: {total_uncompressed:,} bytes")
     print(f"Total results: {total_results:,}")
 
-def write_results(queue: Queue, output_path: str):
-    """Write results to output file as they come in."""
+def write_buffers(f, buffers: list[bytes]) -> None:
+    """Write all buffers to an unbuffered file, gathered by writev where available."""
+    if not hasattr(os, 'writev'):
+        f.write(b''.join(buffers))
+        return
+
+    fd = f.fileno()
+    views = [memoryview(buffer) for buffer in buffers]
+    i = 0
+    while i < len(views):
+        written = os.writev(fd, views[i:i + WRITEV_MAX_BUFFERS])
+        # skip what was written, a partial write can end in the middle of a buffer
+        while i < len(views) and written >= len(views[i]):
+            written -= len(views[i])
+            i += 1
+        if written:
+            views[i] = views[i][written:]
+
+def write_results(rings: list[RingBuffer], workers_done: threading.Event, output_path: str):
+    """Write results to output file as they come in, until all workers are done."""
     f = None
+    batch = []
+    batch_size = 0
     try:
-        f = open(output_path, 'wb')
+        f = open(output_path, 'wb', buffering=0)
         while True:
-            try:
-                result = queue.get()
-                if result is None:
-                    break
-                f.write(result)
-                f.flush()
-            except EOFError:
-                break
-            except KeyboardInterrupt:
-                # On interrupt, make sure we flush and exit cleanly
-                if f is not None:
-                    f.flush()
+            # checked before draining so nothing written before the workers finished is missed
+            done = workers_done.is_set()
+            wrote = False
+            for ring in rings:
+                while True:
+                    try:
+                        result = ring.get()
+                    except queue.Empty:
+                        break
+                    batch.append(result)
+                    batch_size += len(result)
+                    wrote = True
+
+                    if batch_size > WRITE_BATCH_SIZE:
+                        write_buffers(f, batch)
+                        batch = []
+                        batch_size = 0
+
+            if done:
                 break
+            if not wrote:
+                time.sleep(0.01)
+    except KeyboardInterrupt:
+        # On interrupt, make sure we flush and exit cleanly
+        pass
     finally:
         if f is not None:
-            f.flush()
+            write_buffers(f, batch)
             f.close()
 
 def main():
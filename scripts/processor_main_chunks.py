@@ -5,14 +5,41 @@ import signal
 import time
 import threading
 from typing import Optional, Tuple
-from multiprocessing import Pool, Queue, Event, cpu_count, Manager
+from multiprocessing import Pool, Queue, Event, Array, cpu_count, util
 import queue  # for queue exceptions
 from tqdm import tqdm
-from processor_worker import Worker, ProgressUpdate, DataHandler, SplitFinder
+from processor_worker import Worker, ProgressUpdate, SplitFinder
+from processor_main import write_results
+from processor_ring_buffer import RingBuffer
+
+# queues can't be pickled into pool tasks, so each pool process gets them once at startup
+_worker_queues: Optional[Tuple[RingBuffer, Queue, Event]] = None
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+def init_worker(result_rings: list[RingBuffer], ring_owners, progress_queue: Queue, stop_event: Event):
+    """Pool initializer that claims a result ring of its own and keeps the shared queues for the worker tasks"""
+    global _worker_queues
+    # rings have a single producer, so every pool process writes to a different one,
+    # a process the pool starts to replace one that died takes over its ring
+    with ring_owners.get_lock():
+        owners = ring_owners.get_obj()
+        index = next(i for i, pid in enumerate(owners) if pid == 0 or not _is_alive(pid))
+        owners[index] = os.getpid()
+    result_ring = result_rings[index]
+    _worker_queues = (result_ring, progress_queue, stop_event)
+    # the ring outlives the tasks, it's released when the pool process exits
+    util.Finalize(None, result_ring.close, exitpriority=0)
 
 def worker_task(args: Tuple):
     """Worker function that processes a chunk of the file"""
-    worker_id, start, end, input_path, result_queue, progress_queue, data_handler, stop_event = args
+    worker_id, start, end, input_path = args
+    result_queue, progress_queue, stop_event = _worker_queues
     Worker.run_worker(
         worker_id,
         start,
@@ -20,7 +47,6 @@ def worker_task(args: Tuple):
         input_path,
         result_queue,
         progress_queue,
-        data_handler,
         stop_event
     )
 
@@ -45,11 +71,13 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
     finder = SplitFinder(input_path)
     split_points = finder.find_split_points(num_chunks)
 
-    # Create shared queues and event using Manager
-    manager = Manager()
-    result_queue = manager.Queue()
-    progress_queue = manager.Queue()
-    stop_event = manager.Event()
+    # Results go through a shared memory ring per pool process to avoid pickling,
+    # progress updates are rare enough for a multiprocessing queue
+    result_rings = [RingBuffer() for _ in range(num_workers)]
+    # pid of the pool process writing to each ring, 0 while it's unclaimed
+    ring_owners = Array('i', num_workers)
+    progress_queue = Queue()
+    stop_event = Event()
 
     # Set up signal handlers
     def signal_handler(signum, frame):
@@ -59,6 +87,8 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
         if 'pool' in globals():
             pool.terminate()
             pool.join()
+        for ring in result_rings:
+            ring.unlink()
         sys.exit(1)
 
     signal.signal(signal.SIGINT, signal_handler)
@@ -73,11 +103,7 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
             i,
             start,
             end,
-            input_path,
-            result_queue,
-            progress_queue,
-            DataHandler(),
-            stop_event
+            input_path
         )
         worker_args.append(args)
 
@@ -86,14 +112,20 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
     pbar = tqdm(total=total_size, unit='B', unit_scale=True)
 
     # Start result writer thread
+    workers_done = threading.Event()
     result_writer = threading.Thread(
         target=write_results,
-        args=(result_queue, output_path)
+        args=(result_rings, workers_done, output_path)
     )
     result_writer.start()
 
-    # Create and start the pool
-    pool = Pool(processes=num_workers)
+    # Create and start the pool, maxtasksperchild stays unset so pool processes
+    # and their rings are only replaced when one dies
+    pool = Pool(
+        processes=num_workers,
+        initializer=init_worker,
+        initargs=(result_rings, ring_owners, progress_queue, stop_event)
+    )
     async_result = pool.map_async(worker_task, worker_args)
 
     # Monitor progress
@@ -101,26 +133,34 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
     total_results = 0
 
     while not async_result.ready():
+        # block for the first update, then take whatever else has piled up
         try:
-            update: ProgressUpdate = progress_queue.get(timeout=0.1)
+            updates: list[ProgressUpdate] = [progress_queue.get(timeout=0.1)]
         except (EOFError, queue.Empty):
             continue
+        while True:
+            try:
+                updates.append(progress_queue.get_nowait())
+            except (EOFError, queue.Empty):
+                break
 
-        if update is None:
-            continue
+        progress_delta = 0
+        for update in updates:
+            if update is None:
+                continue
 
-        worker_start = split_points[update.worker_id-1][0] if update.worker_id > 0 else 0
-        worker_end = split_points[update.worker_id][0] if update.worker_id < len(split_points) else total_size
+            worker_start = split_points[update.worker_id-1][0] if update.worker_id > 0 else 0
+            worker_end = split_points[update.worker_id][0] if update.worker_id < len(split_points) else total_size
 
-        # Cap progress at worker's assigned range
-        new_progress = min(update.compressed_bytes, worker_end - worker_start)
-        old_progress = progress[update.worker_id]
-        progress[update.worker_id] = new_progress
+            # Cap progress at worker's assigned range
+            new_progress = min(update.compressed_bytes, worker_end - worker_start)
+            progress_delta += new_progress - progress[update.worker_id]
+            progress[update.worker_id] = new_progress
 
-        pbar.update(new_progress - old_progress)
+            total_uncompressed += update.uncompressed_bytes
+            total_results += update.num_entries
 
-        total_uncompressed += update.uncompressed_bytes
-        total_results += update.num_entries
+        pbar.update(progress_delta)
 
     pbar.close()
 
@@ -128,38 +168,18 @@ def process_file(input_path: str, output_path: str, num_workers: Optional[int] =
     pool.close()
     pool.join()
 
-    result_queue.put(None)  # Signal writer to stop
+    workers_done.set()  # Signal writer to stop once the rings are drained
     result_writer.join()
 
+    for ring in result_rings:
+        ring.close()
+        ring.unlink()
+
     # Print completion statistics
     print("\nProcessing complete!")
     print(f"Uncompressed data processed: {total_uncompressed:,} bytes")
     print(f"Total results: {total_results:,}")
 
-def write_results(queue: Queue, output_path: str):
-    """Write results to output file as they come in."""
-    f = None
-    try:
-        f = open(output_path, 'wb')
-        while True:
-            try:
-                result = queue.get()
-                if result is None:
-                    break
-                f.write(result)
-                f.flush()
-            except EOFError:
-                break
-            except KeyboardInterrupt:
-                # On interrupt, make sure we flush and exit cleanly
-                if f is not None:
-                    f.flush()
-                break
-    finally:
-        if f is not None:
-            f.flush()
-            f.close()
-
 def main():
     parser = argparse.ArgumentParser(description='Process a file using multiple workers')
     parser.add_argument('input_path', help='Path to input file')
@@ -1,5 +1,7 @@
 import re
-from collections import Counter
+
+# a 4 digit year bounded by non-digits or string boundaries
+YEAR_PATTERN = re.compile(r'(?:^|[^\d])(\d{4})(?:[^\d]|$)')
 
 def extract_most_likely_year(strings: list[str]) -> int | None:
     """
@@ -14,18 +16,34 @@ def extract_most_likely_year(strings: list[str]) -> int | None:
 
     # Extract all valid years that are bounded by non-digits or string boundaries
     for text in strings:
-        matches = re.finditer(r'(?:^|[^\d])(\d{4})(?:[^\d]|$)', str(text))
+        if not isinstance(text, str):
+            text = str(text)
+
+        # most dates are just the year, which doesn't need the regex
+        if len(text) == 4 and text.isdecimal():
+            matches = (text,)
+        else:
+            matches = YEAR_PATTERN.findall(text)  # only the digits inside the boundaries
+
         for match in matches:
-            year = int(match.group(1))  # group(1) gets the digits inside the boundaries
+            year = int(match)
             if 1450 <= year <= current_year:
                 years.append(year)
 
     if not years:
         return None
-
-    # Get frequencies
-    counts = Counter(years)
-    max_count = max(counts.values())
+    # usually every mention is the same year
+    if years.count(years[0]) == len(years):
+        return years[0]
+
+    # Get frequencies, tracking the highest one as we go
+    counts = {}
+    max_count = 0
+    for year in years:
+        count = counts.get(year, 0) + 1
+        counts[year] = count
+        if count > max_count:
+            max_count = count
     candidates = [year for year, count in counts.items() if count == max_count]
 
     if len(candidates) == 1:
@@ -67,6 +85,7 @@ class TestYearExtraction(unittest.TestCase):
         self.assertEqual(self.extract(["1966", "1966", "1967"]), 1966)
         self.assertEqual(self.extract(["1966", "1967", "1967"]), 1967)
         self.assertEqual(self.extract(["1555", "1555", "1966"]), 1555)
+        self.assertEqual(self.extract(["1966", "c1966", "1966."]), 1966)  # all the same
 
     def test_close_years_tiebreaker(self):
         """Test handling of years close together"""
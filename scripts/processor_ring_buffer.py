@@ -0,0 +1,170 @@
+"""
+Single producer, single consumer ring buffer of byte messages in shared memory
+"""
+
+from multiprocessing import Value
+from multiprocessing.shared_memory import SharedMemory
+import queue  # for queue exceptions
+import struct
+import time
+from typing import Optional
+
+_LENGTH = struct.Struct('>I')
+
+class RingBuffer:
+    """Pass bytes from one worker process to a reader without pickling.
+
+    Messages are stored as a 4 byte length followed by the payload, wrapping
+    around the end of the buffer. The head (bytes consumed) and tail (bytes
+    produced) are ever increasing counters, each written by only one side.
+    They are locked shared values, and taking the lock is a memory barrier,
+    so the reader never sees the new tail before the message it publishes,
+    even on CPUs that reorder stores.
+
+    Passed to worker processes when they start, like other synchronized
+    shared objects.
+
+    Has the same put/get interface as a Queue, so it can stand in for one.
+    """
+
+    def __init__(self, size: int = 4 * 1024 * 1024, name: Optional[str] = None, head=None, tail=None):
+        if name is None:
+            self.shm = SharedMemory(create=True, size=size)
+            self.head = Value('Q', 0)
+            self.tail = Value('Q', 0)
+        else:
+            # attached by a worker, the creator is in charge of unlinking
+            self.shm = SharedMemory(name=name, track=False)
+            self.head = head
+            self.tail = tail
+        self.capacity = size
+        self.data = self.shm.buf[:size]
+
+    def __reduce__(self):
+        return (RingBuffer, (self.capacity, self.shm.name, self.head, self.tail))
+
+    def _write(self, pos: int, data: bytes) -> None:
+        start = pos % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.data[start:start + first] = data[:first]
+        self.data[:len(data) - first] = data[first:]
+
+    def _read(self, pos: int, size: int) -> bytes:
+        start = pos % self.capacity
+        first = min(size, self.capacity - start)
+        return bytes(self.data[start:start + first]) + bytes(self.data[:size - first])
+
+    def put(self, data: bytes, block: bool = True, timeout: Optional[float] = None) -> None:
+        """Add a message, waiting for the reader to make room unless block is False.
+
+        Raises:
+            queue.Full: If there isn't enough room and block is False or timeout
+                seconds have passed.
+            ValueError: If the message can never fit.
+        """
+        needed = _LENGTH.size + len(data)
+        if needed > self.capacity:
+            raise ValueError(f"Message of {len(data)} bytes doesn't fit in ring buffer")
+
+        tail = self.tail.value
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.capacity - (tail - self.head.value) < needed:
+            if not block or (deadline is not None and time.monotonic() >= deadline):
+                raise queue.Full
+            time.sleep(0.001)
+
+        self._write(tail, _LENGTH.pack(len(data)))
+        self._write(tail + _LENGTH.size, data)
+        self.tail.value = tail + needed
+
+    def get(self) -> bytes:
+        """Remove and return the oldest message.
+
+        Raises:
+            queue.Empty: If there are no messages.
+        """
+        head = self.head.value
+        if head == self.tail.value:
+            raise queue.Empty
+
+        size = _LENGTH.unpack(self._read(head, _LENGTH.size))[0]
+        data = self._read(head + _LENGTH.size, size)
+        self.head.value = head + _LENGTH.size + size
+        return data
+
+    def close(self) -> None:
+        self.data.release()
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+import unittest
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.ring = RingBuffer(32)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def test_messages_wrap_around(self):
+        # 14 bytes per message in a 32 byte ring, so both the payload and (at offset 30)
+        # the length in front of it get split across the end
+        for i in range(20):
+            message = bytes([i]) * 10
+            self.ring.put(message)
+            self.assertEqual(self.ring.get(), message)
+        self.assertGreater(self.ring.tail.value, self.ring.capacity)
+
+    def test_messages_keep_their_order(self):
+        self.ring.put(b'first')
+        self.ring.put(b'second')
+        self.assertEqual(self.ring.get(), b'first')
+        self.ring.put(b'third')
+        self.assertEqual(self.ring.get(), b'second')
+        self.assertEqual(self.ring.get(), b'third')
+
+    def test_put_raises_full(self):
+        self.ring.put(bytes(20))
+        with self.assertRaises(queue.Full):
+            self.ring.put(bytes(20), timeout=0.01)
+        with self.assertRaises(queue.Full):
+            self.ring.put(bytes(20), block=False)
+        # the message that was there is untouched
+        self.assertEqual(self.ring.get(), bytes(20))
+
+    def test_put_raises_for_oversized_message(self):
+        with self.assertRaises(ValueError):
+            self.ring.put(bytes(29))
+
+    def test_get_raises_empty(self):
+        with self.assertRaises(queue.Empty):
+            self.ring.get()
+        self.ring.put(b'message')
+        self.ring.get()
+        with self.assertRaises(queue.Empty):
+            self.ring.get()
+
+    def test_reduce_attaches_to_the_same_ring(self):
+        self.ring.put(b'before')
+        self.ring.put(b'queued')
+        self.ring.get()
+
+        # what unpickling in a worker process does
+        constructor, args = self.ring.__reduce__()
+        attached = constructor(*args)
+        try:
+            self.assertEqual(attached.capacity, self.ring.capacity)
+            self.assertEqual(attached.head.value, self.ring.head.value)
+            self.assertEqual(attached.tail.value, self.ring.tail.value)
+
+            self.assertEqual(attached.get(), b'queued')
+            attached.put(b'from worker')
+            self.assertEqual(self.ring.get(), b'from worker')
+        finally:
+            attached.close()
+
+if __name__ == '__main__':
+    unittest.main()
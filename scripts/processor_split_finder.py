@@ -1,8 +1,10 @@
 import zstandard as zstd
 import json
-import io
+import mmap
 from typing import Optional
 
+PROBE_READ_SIZE = 64 * 1024
+
 class SplitValidator:
     """Determines if two consecutive JSONs make a valid split point"""
 
@@ -17,69 +19,49 @@ class SplitFinder:
         self.filepath = filepath
         self.validator = validator or SplitValidator()
         self.file_size = 0
+        # reused for every probe, one split point can take many attempts
+        self.dctx = zstd.ZstdDecompressor()
 
         # Initialize file size
         with open(filepath, 'rb') as f:
             f.seek(0, 2)  # Seek to end
             self.file_size = f.tell()
 
-    def _find_next_frame(self, fh) -> Optional[int]:
-        """Find next Zstandard frame from current position"""
-        while True:
-            chunk = fh.read(4096)
-            if not chunk:
-                return None
-
-            magic_pos = chunk.find(zstd.FRAME_HEADER)
-            if magic_pos != -1:
-                # Return absolute position of frame start
-                return fh.tell() - len(chunk) + magic_pos
-
-            if fh.tell() == self.file_size:
-                return None
-
-            # Back up a few bytes in case magic number spans chunks
-            fh.seek(-4, 1)  # 1 means relative to current position
+    def _find_next_frame(self, mm: mmap.mmap, start_pos: int) -> Optional[int]:
+        """Find next Zstandard frame at or after start_pos"""
+        frame_pos = mm.find(zstd.FRAME_HEADER, start_pos)
+        return frame_pos if frame_pos != -1 else None
 
     def _read_jsons_at_position(self, position: int):
-        """Read num_jsons complete JSON objects starting at position"""
+        """Yield the complete JSON objects decoded starting at position"""
         with open(self.filepath, 'rb') as fh:
             fh.seek(position)
-
-            # Initialize decompressor for this position
-            dctx = zstd.ZstdDecompressor()
-            reader = dctx.stream_reader(fh)
-            text_stream = io.TextIOWrapper(reader, encoding='utf-8')
-
-            jsons = []
+            reader = self.dctx.stream_reader(fh)
 
             try:
+                # a split is usually found within the first few records, so read
+                # one block at a time and split it into lines as bytes
+                leftover = b''
                 while True:
-                    try:
-                        line = text_stream.readline()
-                    except UnicodeDecodeError:
-                        # ignore split unicode chars
-                        # print('UnicodeDecodeError')
-                        continue
-
-                    if not line:
+                    block = reader.read(PROBE_READ_SIZE)
+                    lines = (leftover + block).split(b'\n')
+                    # the last line is incomplete until the next block, or the end of the stream
+                    leftover = lines.pop() if block else b''
+
+                    for line in lines:
+                        if line.strip():
+                            try:
+                                yield json.loads(line)
+                            except ValueError:
+                                # invalid JSON or split unicode chars
+                                continue
+
+                    if not block:
                         break
 
-                    if line.strip():
-                        try:
-                            yield json.loads(line)
-                            # jsons.append(json.loads(line))
-                            # if len(jsons) >= num_jsons:
-                            #     break
-                        except json.JSONDecodeError:
-                            continue
-
             finally:
-                # buffer.close()
                 reader.close()
 
-            return jsons
-
     def find_split_points(self, num_splits: int) -> list[tuple[int, str]]:
         """
         Find appropriate split points for parallel processing.
@@ -94,6 +76,14 @@ class SplitFinder:
             for i in range(1, num_splits)
         ]
 
+        if self.file_size == 0:
+            raise RuntimeError(f"Could not find valid split points in empty file {self.filepath}")
+
+        # frame headers are searched for in a mapping of the whole file, leaving the reads to the kernel
+        with open(self.filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return self._find_split_points(mm, target_percentages)
+
+    def _find_split_points(self, mm: mmap.mmap, target_percentages: list[float]) -> list[tuple[int, str]]:
         splits = []
         for percentage in target_percentages:
             target_byte = int(percentage * self.file_size)
@@ -101,9 +91,7 @@ class SplitFinder:
             # Keep searching until we find a valid split point
             current_pos = target_byte
             while True:
-                with open(self.filepath, 'rb') as fh:
-                    fh.seek(current_pos)
-                    frame_pos = self._find_next_frame(fh)
+                frame_pos = self._find_next_frame(mm, current_pos)
 
                 if frame_pos is None:
                     raise RuntimeError(f"Could not find valid split point for percentage {percentage}")
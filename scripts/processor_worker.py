@@ -2,7 +2,7 @@ import json
 from multiprocessing import Process, Queue, Event
 import queue  # for queue exceptions
 import io
-import time
+import mmap
 from typing import Optional
 from dataclasses import dataclass
 
@@ -12,6 +12,11 @@ from processor_data_handler import DataHandler
 from isbn_props_decoder import ISBNPropsDecoder
 from processor_split_finder import SplitFinder
 
+READ_BUFFER_SIZE = 1 << 20
+PUT_TIMEOUT = 1.0
+# lines read between progress updates and stop checks
+PROGRESS_INTERVAL = 1024
+
 @dataclass
 class ProgressUpdate:
     worker_id: int
@@ -23,15 +28,15 @@ class Worker:
     @staticmethod
     def run_worker(worker_id: int, start: tuple[int, str], end: tuple[int, str],
                   file_path: str, queue: Queue, progress_queue: Queue,
-                  data_handler, stop_event: Event):
+                  stop_event: Event):
         """Static method to run as a separate process"""
         worker = Worker(worker_id, start, end, file_path, queue, progress_queue,
-                       data_handler, stop_event)
+                       stop_event)
         worker.run()
 
     def __init__(self, worker_id: int, start: tuple[int, str], end: tuple[int, str],
                  file_path: str, queue: Queue, progress_queue: Queue,
-                 data_handler, stop_event: Event):
+                 stop_event: Event):
         self.worker_id = worker_id
         self.start_pos = start[0]
         self.start_id = start[1] if start[1] != '' else None
@@ -40,53 +45,64 @@ class Worker:
         self.file_path = file_path
         self.queue = queue
         self.progress_queue = progress_queue
-        self.data_handler = data_handler
+        # built here rather than shipped from the parent process
+        self.data_handler = DataHandler()
         self.uncompressed_bytes = 0
         self.prev_fh_tell = None
+        self.lines_since_progress = PROGRESS_INTERVAL
         self.stop_event = stop_event
         self.num_entries = 0
 
         self.batch_size = 4 * 1024
-        self.bytes_buffer = b''
+        # results waiting to be sent as one batch
+        self.result_chunks: list[bytes] = []
+        self.result_size = 0
 
     def run(self):
-        with open(self.file_path, 'rb') as fh:
+        # read through a shared read-only mapping of the page cache instead of
+        # read() calls, it still tracks its position for the progress updates
+        with open(self.file_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as fh:
             fh.seek(self.start_pos)
             dctx = zstandard.ZstdDecompressor()
             reader = dctx.stream_reader(fh)
-            text_stream = io.TextIOWrapper(reader, encoding='utf-8')
+            # lines are parsed as bytes, json.loads handles the UTF-8 decoding
+            line_reader = io.BufferedReader(reader, buffer_size=READ_BUFFER_SIZE)
 
             hit_end_id = False
 
             try:
                 while True:
-                    if fh.tell() != self.prev_fh_tell:
+                    if self.lines_since_progress >= PROGRESS_INTERVAL:
+                        self.lines_since_progress = 0
                         if self.stop_event.is_set():
                             print(f"Worker {self.worker_id} stopping before read...")
                             break
 
-                        self.prev_fh_tell = fh.tell()
-                        compressed_pos = fh.tell() - self.start_pos
-                        self.progress_queue.put(ProgressUpdate(
-                            self.worker_id,
-                            compressed_pos,
-                            self.uncompressed_bytes,
-                            self.num_entries
-                        ))
-                        self.num_entries = 0
-                        self.uncompressed_bytes = 0
+                        fh_tell = fh.tell()
+                        if fh_tell != self.prev_fh_tell:
+                            self.prev_fh_tell = fh_tell
+                            self.progress_queue.put(ProgressUpdate(
+                                self.worker_id,
+                                fh_tell - self.start_pos,
+                                self.uncompressed_bytes,
+                                self.num_entries
+                            ))
+                            self.num_entries = 0
+                            self.uncompressed_bytes = 0
 
-                    line = text_stream.readline()
+                    line = line_reader.readline()
 
                     if not line:
                         break
 
                     self.uncompressed_bytes += len(line)
+                    self.lines_since_progress += 1
 
                     if line.strip():
                         try:
                             data = json.loads(line)
-                        except json.JSONDecodeError as e:
+                        except (json.JSONDecodeError, UnicodeDecodeError) as e:
                             # we should not be expecting invalid JSON after reaching start_id
                             if self.start_id is None:
                                 print(f"Warning: Worker {self.worker_id} encountered invalid JSON at position {self.uncompressed_bytes} {str(e)}")
@@ -104,37 +120,38 @@ class Worker:
 
                         result = self.data_handler.process(data)
                         if result is not None:
-                            self.bytes_buffer += result
+                            self.result_chunks.append(result)
+                            self.result_size += len(result)
                             self.num_entries += 1
 
-                            if len(self.bytes_buffer) > self.batch_size:
+                            if self.result_size > self.batch_size:
+                                batch = b''.join(self.result_chunks)
+                                # wait for the reader to make room, checking for a stop now and then
                                 while True:
-                                    if self.stop_event.is_set():
-                                        print(f"Worker {self.worker_id} stopping before put...")
-                                        break
                                     try:
-                                        self.queue.put(self.bytes_buffer, block=False)
+                                        self.queue.put(batch, timeout=PUT_TIMEOUT)
                                         break
                                     except queue.Full:
-                                        print('SLEEP')
-                                        time.sleep(0.1)
-                                        continue
+                                        if self.stop_event.is_set():
+                                            print(f"Worker {self.worker_id} stopping before put...")
+                                            break
 
-                                self.bytes_buffer = b''
+                                self.result_chunks.clear()
+                                self.result_size = 0
 
                     if hit_end_id:
                         break
 
                 final_result = self.data_handler.process({})  # Empty dict to trigger flush
                 if final_result is not None:
-                    self.bytes_buffer += final_result
+                    self.result_chunks.append(final_result)
                     self.num_entries += 1
 
-                self.queue.put(self.bytes_buffer)
+                self.queue.put(b''.join(self.result_chunks))
 
                 self.progress_queue.put(ProgressUpdate(
                     self.worker_id,
-                    compressed_pos,
+                    fh.tell() - self.start_pos,
                     self.uncompressed_bytes,
                     self.num_entries
                 ))
@@ -174,7 +191,6 @@ if __name__ == "__main__":
                     file_path,
                     result_queue,
                     progress_queue,
-                    DataHandler(),
                     stop_event
                 )
             )
@@ -3,10 +3,16 @@ Renders ISBN properties into tiles
 """
 
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import shutil
+import tempfile
 import bencodepy
 from tqdm import tqdm
 import numpy as np
-from typing import BinaryIO, OrderedDict, cast
+from typing import BinaryIO, Optional, OrderedDict, cast
 from PIL import Image
 
 from pathlib import Path
@@ -15,58 +21,133 @@ from typing import Iterator
 
 import zstandard
 
-from common import ISBNsBinaryProcessor, get_isbn_code_pos
-from isbn_props_decoder import ISBNPropsDecoder
+from common import NumpyISBNsBinaryProcessor, get_isbn_code_pos_array, optimize_tiles
+from isbn_props_decoder import ISBNPropsArrays, ISBNPropsDecoder
+
+POSITIONS_BATCH_SIZE = 1 << 20
+PENDING_TILES_PER_WORKER = 4
 
 class ISBNMatrixProcessor:
-    def __init__(self):
+    def __init__(self, scratch_dir: Optional[Path] = None):
+        """
+        Args:
+            scratch_dir: If given, the tensors are memory-mapped from temporary files
+                in this directory instead of kept in RAM
+        """
         self.decoder = ISBNPropsDecoder()
-        # Dictionary to store 3D tensors (10_000 x 10_000 x 2) for each prefix
-        # Index 0 in last dimension is for years (as offset from 2025)
-        # Index 1 in last dimension is for holdings count
+        self.scratch_dir = scratch_dir
+        # Dictionary to store tensors for each prefix, as separate 10_000 x 10_000
+        # matrices per category so that each one is contiguous
+        # Index 0 is for years (as offset from 2025)
+        # Index 1 is for holdings count
         # Value 0 means no data
+        self.tensors: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+
+        # zeros are allocated lazily, so untouched pages cost no memory
         from collections import defaultdict
-        self.tensors = defaultdict(lambda: np.full((10_000, 10_000, 2), 0, dtype=np.uint8))
+        self.zero_holdings_mats = defaultdict(lambda: np.zeros((10_000, 10_000), dtype=bool))
+
+    def _create_matrix(self, name: str) -> np.ndarray:
+        shape = (10_000, 10_000)
+        if self.scratch_dir is None:
+            return np.zeros(shape, dtype=np.uint8)
 
-        self.zero_holdings_mats = defaultdict(lambda: np.full((10_000, 10_000), False, dtype=bool))
+        # the file is sparse until written and removed once the mapping is gone
+        with tempfile.TemporaryFile(dir=self.scratch_dir, prefix=f'{name}_') as f:
+            return np.memmap(f, dtype=np.uint8, mode='w+', shape=shape)
+
+    def get_tensor(self, prefix: int) -> tuple[np.ndarray, np.ndarray]:
+        """Get the year and holdings matrices of a prefix, creating empty ones if needed."""
+        tensor = self.tensors.get(prefix)
+        if tensor is None:
+            tensor = tuple(self._create_matrix(f'{category}_{prefix}') for category in CATEGORIES)
+            self.tensors[prefix] = tensor
+        return tensor
 
     def process_stream(self, stream: BinaryIO) -> None:
         """Process a binary stream of ISBN properties."""
+        # records are gathered into flat arrays and added to the tensors in bulk
+        holdings_counts = []
+        years = []
+        isbn_counts = []
+        isbn_positions = []
+
+        def add_batch():
+            self.add_arrays(ISBNPropsArrays(
+                holdings_counts=np.array(holdings_counts, dtype=np.int16),
+                years=np.array(years, dtype=np.int16),
+                isbn_counts=np.array(isbn_counts, dtype=np.uint8),
+                isbn_positions=np.array(isbn_positions, dtype=np.uint32)
+            ))
+            holdings_counts.clear()
+            years.clear()
+            isbn_counts.clear()
+            isbn_positions.clear()
+
         for record in self.decoder.decode_stream(stream):
-            if record.year is None and record.holdings_count == 0:
-                continue
-
-            for position in record.isbn_positions:
-                # Extract prefix (first 2 digits) and remainder
-                prefix = position // 100_000_000
-                remainder = position % 100_000_000
-
-                # Get row and column for the remainder
-                col, row = get_isbn_code_pos(remainder)
-
-                # defaultdict automatically creates matrix if needed
-                matrix = self.tensors[prefix]
-
-                if record.year is not None:
-                    # year_offset low to high -> more old
-                    year_offset = 2025 - record.year
-
-                    # combine publication year by choosing the older year
-                    matrix[row, col, 0] = max(matrix[row, col, 0], min(255, year_offset + 1))
-                if record.holdings_count is not None:
-                    if record.holdings_count > 0:
-                        # encoded_count low to high -> more rare
-                        encoded_count = max(1, 256 - record.holdings_count)
-                        prev_value = matrix[row, col, 1]
-
-                        if prev_value == 0:
-                            # if no data, directly set it
-                            matrix[row, col, 1] = encoded_count
-                        else:
-                            # combine holdings count by choosing the less rare count
-                            matrix[row, col, 1] = min(prev_value, encoded_count)
-                    else:
-                        self.zero_holdings_mats[prefix][row, col] = True
+            holdings_counts.append(-1 if record.holdings_count is None else record.holdings_count)
+            years.append(-1 if record.year is None else record.year)
+            isbn_counts.append(len(record.isbn_positions))
+            isbn_positions.extend(record.isbn_positions)
+
+            if len(isbn_positions) >= POSITIONS_BATCH_SIZE:
+                add_batch()
+
+        if isbn_positions:
+            add_batch()
+
+    def add_arrays(self, arrays: ISBNPropsArrays) -> None:
+        """Combine decoded records into the tensors, -1 meaning missing holdings count or year."""
+        counts = arrays.isbn_counts.astype(np.int64)
+        holdings_counts = np.repeat(arrays.holdings_counts, counts)
+        years = np.repeat(arrays.years, counts)
+        positions = arrays.isbn_positions
+
+        keep = ~((years < 0) & (holdings_counts == 0))
+        holdings_counts = holdings_counts[keep]
+        years = years[keep]
+        positions = positions[keep]
+
+        # Extract prefix (first 2 digits) and remainder
+        prefixes = positions // 100_000_000
+        # Get row and column for the remainder, as an index into the flattened matrices
+        # since ufunc.at is far faster with a single index array
+        cols, rows = get_isbn_code_pos_array((positions % 100_000_000).astype(np.int64))
+        cells = rows * 10_000 + cols
+
+        for prefix in np.unique(prefixes).tolist():
+            in_prefix = prefixes == prefix
+            prefix_cells = cells[in_prefix]
+            prefix_years = years[in_prefix]
+            prefix_holdings = holdings_counts[in_prefix]
+
+            year_mat, holdings_mat = (mat.reshape(-1) for mat in self.get_tensor(prefix))
+
+            has_year = prefix_years >= 0
+            # year_offset low to high -> more old
+            year_offsets = 2025 - prefix_years[has_year]
+            # combine publication year by choosing the older year
+            np.maximum.at(
+                year_mat,
+                prefix_cells[has_year],
+                np.minimum(255, year_offsets + 1).astype(np.uint8)
+            )
+
+            has_holdings = prefix_holdings > 0
+            if has_holdings.any():
+                # encoded_count low to high -> more rare
+                encoded_counts = np.maximum(1, 256 - prefix_holdings[has_holdings]).astype(np.uint8)
+                holdings_cells = prefix_cells[has_holdings]
+
+                # if no data, any count is less rare than the highest value,
+                # so put that in first and combine by choosing the less rare count
+                empty = holdings_cells[holdings_mat[holdings_cells] == 0]
+                holdings_mat[empty] = 255
+                np.minimum.at(holdings_mat, holdings_cells, encoded_counts)
+
+            is_zero_holdings = prefix_holdings == 0
+            if is_zero_holdings.any():
+                self.zero_holdings_mats[prefix].reshape(-1)[prefix_cells[is_zero_holdings]] = True
 
     def process_file(self, file_path: Path) -> None:
         """
@@ -93,42 +174,37 @@ class ISBNMatrixProcessor:
 
                 self.process_stream(ProgressReader(f, pbar))
 
-def split_tensor(tensor: np.ndarray, mask: np.ndarray, dtype=np.uint8) -> tuple[np.ndarray, np.ndarray]:
-    """
-    Split a tensor into two based on a boolean mask.
-
-    Args:
-        tensor: Input tensor of shape (10000, 10000, 2)
-        mask: Boolean matrix of shape (10000, 10000)
+CATEGORIES = ['years', 'holdings']
 
-    Returns:
-        Tuple of (true_tensor, false_tensor) where each is (10000, 10000, 2)
-        Values where mask is False get 0 in true_tensor
-        Values where mask is True get 0 in false_tensor
+def downsample_max(plane: np.ndarray, factor: int) -> np.ndarray:
     """
-    # Create two new tensors filled with 0
-    true_tensor = np.full_like(tensor, 0, dtype=dtype)
-    false_tensor = np.full_like(tensor, 0, dtype=dtype)
+    Take the maximum of each factor x factor block of a 2D array.
 
-    # Expand mask to match tensor shape for broadcasting
-    mask_3d = mask[:, :, np.newaxis]
+    Combines strided slices with np.maximum, which is much faster than
+    reducing a (h, factor, w, factor) reshape over two axes.
+    """
+    if factor == 1:
+        return plane
 
-    # Copy values based on mask
-    np.copyto(true_tensor, tensor, where=mask_3d)
-    np.copyto(false_tensor, tensor, where=~mask_3d)
+    rows = plane[0::factor].copy()
+    for k in range(1, factor):
+        np.maximum(rows, plane[k::factor], out=rows)
 
-    return true_tensor, false_tensor
+    result = rows[:, 0::factor].copy()
+    for k in range(1, factor):
+        np.maximum(result, rows[:, k::factor], out=result)
 
-CATEGORIES = ['years', 'holdings']
+    return result
 
-def iter_tensor_tiles(prefix: int, tensor: np.ndarray, scales: list[tuple[int, int]]) -> Iterator[tuple[str, Path, np.ndarray]]:
+def iter_tensor_tiles(prefix: int, tensor: tuple[np.ndarray, ...], scales: list[tuple[int, int]], mask: Optional[np.ndarray] = None) -> Iterator[tuple[str, Path, np.ndarray]]:
     """
     Generate tiles from a tensor, yielding (category, path, data) for each tile.
 
     Args:
         prefix: Two-digit prefix string
-        tensor: 10000x10000x2 numpy array containing year offsets and holdings
+        tensor: 10000x10000 numpy matrices of year offsets and holdings, in CATEGORIES order
         scales: list of (divisions, factor) tuples
+        mask: Optional 10000x10000 boolean matrix, values where it is False are treated as 0
 
     Yields:
         Tuples of (category, tile_name, tile_data) where:
@@ -140,48 +216,49 @@ def iter_tensor_tiles(prefix: int, tensor: np.ndarray, scales: list[tuple[int, i
     # for dim, category in enumerate(CATEGORIES):
     #     data = tensor[:, :, dim]
 
+    if mask is None:
+        planes = list(tensor)
+    else:
+        planes = [np.where(mask, plane, 0) for plane in tensor]
+
     for divisions, factor in scales:
         n = 10_000 // divisions
+        m = n // factor
+
+        # downsample the whole tensor once per scale, then cut it into tiles
+        downsampled = [downsample_max(plane, factor) for plane in planes]
+        # and find which tiles have any data, so empty ones are a lookup
+        has_data = [downsample_max(plane, m) != 0 for plane in downsampled]
 
         for i in range(divisions):
             for j in range(divisions):
                 for dim, category in enumerate(CATEGORIES):
-                    # Extract tile coordinates
-                    row_start = i * n
-                    row_end = (i + 1) * n
-                    col_start = j * n
-                    col_end = (j + 1) * n
-
-                    if factor == 1:
-                        tile = tensor[row_start:row_end, col_start:col_end, dim]
-                    else:
-                        # Reshape and take minimum for each block
-                        tile_data = tensor[row_start:row_end, col_start:col_end, dim]
-                        shape = (n // factor, factor, n // factor, factor)
-                        tile = tile_data.reshape(shape).max(axis=(1, 3))
-
                     # Yield tile data or None if empty
                     tile_name = Path(f"{divisions}_{str(prefix).zfill(2)}_{i}_{j}")
-                    if np.any(tile != 0):
+                    if has_data[dim][i, j]:
+                        tile = downsampled[dim][i * m:(i + 1) * m, j * m:(j + 1) * m]
                         yield category, tile_name, tile.astype(np.uint8)
                     else:
                         yield category, tile_name, None
 
-class NumpyISBNsBinaryProcessor(ISBNsBinaryProcessor):
-    def create_block(self):
-        return np.full(self.get_size(), False, dtype=bool)
-    def add_to_block(self, block, x, y):
-        block[y, x] = True
+def save_tile(out_path: Path, tile_data: np.ndarray, optimize: bool = True) -> None:
+    if optimize:
+        Image.fromarray(tile_data, mode='L').save(out_path, format='png', optimize=True, compress_level=9)
+    else:
+        # leave the compression to a post-pass
+        Image.fromarray(tile_data, mode='L').save(out_path, format='png', compress_level=6)
 
-def process_data(input_path: Path, output_path: Path, isbncodes_path: Path) -> None:
+def process_data(input_path: Path, output_path: Path, isbncodes_path: Path, scratch_dir: Optional[Path] = None,
+                 workers: Optional[int] = None, oxipng: bool = False) -> None:
     print(f"### Processing {input_path}")
 
     isbncodes_data = bencodepy.bread(zstandard.ZstdDecompressor().stream_reader(open(isbncodes_path, 'rb')))
     isbncodes_data = cast(OrderedDict, isbncodes_data)
 
-    isbncodes_processor = NumpyISBNsBinaryProcessor()
+    workers = workers or os.cpu_count() or 1
+    isbncodes_processor = NumpyISBNsBinaryProcessor(workers)
 
-    processor = ISBNMatrixProcessor()
+    processor = ISBNMatrixProcessor(scratch_dir)
 
     processor.process_file(input_path)
 
@@ -198,22 +275,47 @@ def process_data(input_path: Path, output_path: Path, isbncodes_path: Path) -> N
 
     print(sorted(processor.tensors.keys()))
 
-    with tqdm(total=total_tiles, position=1) as pbar:
-        for prefix, md5_mask in isbncodes_processor.process(isbncodes_data[b'md5']):
-            tensor = processor.tensors.get(prefix)
-
-            if tensor is None:
-                print(f"Prefix {prefix} not found in tensors!")
-                continue
+    # PNG encoding is the slowest part, so tiles are saved in other processes
+    # with a bounded number of them in flight, started from a forkserver since
+    # the block rendering pool's threads are already running when they are
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('forkserver')) if workers > 1 else None
+    try:
+        with tqdm(total=total_tiles, position=1) as pbar:
+            pending = deque()
+            for prefix, md5_mask in isbncodes_processor.process(isbncodes_data[b'md5']):
+                tensor = processor.tensors.get(prefix)
+
+                if tensor is None:
+                    print(f"Prefix {prefix} not found in tensors!")
+                    continue
+
+                for mask, suffix in [(md5_mask, 'in'), (~md5_mask, 'out')]:
+                    for category, rel_path, tile_data in iter_tensor_tiles(prefix, tensor, scales, mask):
+                        if tile_data is None:
+                            pbar.update(1)
+                            continue
 
-            tensor_in, tensor_out = split_tensor(tensor, md5_mask)
-            for t, suffix in [(tensor_in, 'in'), (tensor_out, 'out')]:
-                for category, rel_path, tile_data in iter_tensor_tiles(prefix, t, scales):
-                    if tile_data is not None:
                         out_path = output_path / f"{category}_{suffix}" / rel_path.with_suffix(".png")
-                        Image.fromarray(tile_data, mode='L').save(out_path, format='png', optimize=True, compress_level=9)
-
-                    pbar.update(1)
+                        if executor is None:
+                            save_tile(out_path, tile_data, not oxipng)
+                            pbar.update(1)
+                            continue
+
+                        pending.append(executor.submit(save_tile, out_path, tile_data, not oxipng))
+                        if len(pending) >= PENDING_TILES_PER_WORKER * workers:
+                            pending.popleft().result()
+                            pbar.update(1)
+
+            while pending:
+                pending.popleft().result()
+                pbar.update(1)
+    finally:
+        isbncodes_processor.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if oxipng:
+        optimize_tiles(output_path)
 
     print(f"### Outputs written to {output_path}")
 
@@ -222,10 +324,17 @@ def main():
     parser.add_argument('input', type=Path, help='Input file path')
     parser.add_argument('output', type=Path, help='Output path')
     parser.add_argument('--isbncodes', type=Path, help='aa_isbn13_codes')
+    parser.add_argument('--scratch', type=Path, help='Directory for memory-mapped tensors (default: keep them in RAM)')
+    parser.add_argument('--workers', type=int, help='Number of processes encoding tiles (default: CPU count)')
+
+    parser.add_argument('--oxipng', action='store_true', help='Save tiles quickly and optimize them with oxipng afterwards')
 
     args = parser.parse_args()
 
-    process_data(args.input, args.output, args.isbncodes)
+    if args.oxipng and shutil.which('oxipng') is None:
+        parser.error("oxipng not found in PATH")
+
+    process_data(args.input, args.output, args.isbncodes, args.scratch, args.workers, args.oxipng)
 
 if __name__ == "__main__":
     main()
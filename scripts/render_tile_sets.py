@@ -4,26 +4,49 @@ Renders visualizations of ISBNs at multiple scales over multiple sets
 
 import os
 import argparse
+import shutil
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
-from typing import OrderedDict, cast
-from PIL import Image, ImageChops
+from typing import Optional, OrderedDict, cast
+import numpy as np
+from PIL import Image
 import bencodepy
 from tqdm import tqdm
 import zstandard
-from collections import defaultdict
-
-from common import ISBNsBinaryProcessor, get_isbn_code_pos
-
-class PILISBNsBinaryProcessor(ISBNsBinaryProcessor):
-    def create_block(self):
-        return Image.new("1", self.get_size(), 0)
-
-    def add_to_block(self, block, x, y):
-        block.putpixel((x, y), 1)
-
-def save_block(path: Path, id: int, block: Image.Image):
+from collections import defaultdict, deque
+from functools import partial
+
+from common import NumpyISBNsBinaryProcessor, optimize_tiles
+
+PENDING_TILES_PER_WORKER = 4
+
+def save_tile(out_path: Path, tile: Image.Image, optimize: bool = True) -> None:
+    # optimize=True makes these tiles bigger, level 9 is what's worth the time
+    if optimize:
+        tile.save(out_path, compress_level=9)
+    else:
+        # leave the compression to a post-pass
+        tile.save(out_path, compress_level=6)
+
+def count_pixels(block_array: np.ndarray, factor: int) -> np.ndarray:
+    """Count the set pixels in each factor x factor square of a boolean block"""
+    h, w = block_array.shape
+    return block_array.reshape(h // factor, factor, w // factor, factor).sum(axis=(1, 3), dtype=np.uint16)
+
+def sparse_levels(factor: int) -> np.ndarray:
+    """
+    Map a count of set pixels in a factor x factor square to a grey level,
+    where a single pixel doesn't get rounded down to zero
+    """
+    k = 1 / factor / factor
+    levels = (np.arange(factor * factor + 1) / (factor * factor) - k) / (1 - k) * 254 + 1
+    # truncated like converting from 'F' to 'L', so an empty square stays 0
+    return np.clip(levels, 0, 255).astype(np.uint8)
+
+def save_block(path: Path, id: int, block_array: np.ndarray,
+               executor: Optional[Executor] = None, workers: int = 1, optimize: bool = True):
+    block = Image.fromarray(block_array)
     block_greyscale = block.convert('L')
-    block_float = block.convert('F')
     os.makedirs(path, exist_ok=True)
 
     prefix = str(id).rjust(2, '0')
@@ -31,11 +54,15 @@ def save_block(path: Path, id: int, block: Image.Image):
     scales = [(1, 50), (2, 25), (5, 10), (10, 5), (20, 1)]
 
     pbar = tqdm(total=sum(d * d for d, _ in scales), desc=str(id), position=1, leave=False)
+    pending = deque()
 
     for divisions, factor in scales:
         n = 10_000 // divisions
 
-        k = 1 / factor / factor
+        if factor >= 16:
+            # grey levels of the whole block at this scale
+            sparse = sparse_levels(factor)[count_pixels(block_array, factor)]
+            m = n // factor
 
         for i in range(divisions):
             for j in range(divisions):
@@ -45,62 +72,86 @@ def save_block(path: Path, id: int, block: Image.Image):
                 elif factor < 16:
                     tile = block_greyscale.reduce(factor, box)
                 else:
-                    # don't let singular pixels get rounded down to zero
-                    tile = block_float.reduce(factor, box)
-                    tile = tile.point(lambda x: (x / 255 - k) / (1 - k) * 254 + 1)
-                    tile = tile.convert('L')
+                    tile = Image.fromarray(sparse[i * m:(i + 1) * m, j * m:(j + 1) * m])
 
-                if any(x != 0 for x in tile.getdata()):
-                    tile.save(path / f"{divisions}_{prefix}_{i}_{j}.png", optimize=True, compress_level=9)
+                if tile.getbbox() is None:
+                    pbar.update(1)
+                    continue
 
-                    # TODO: yield?
+                out_path = path / f"{divisions}_{prefix}_{i}_{j}.png"
+                if executor is None:
+                    save_tile(out_path, tile, optimize)
+                    pbar.update(1)
+                    continue
 
-                pbar.update(1)
+                pending.append(executor.submit(save_tile, out_path, tile, optimize))
+                if len(pending) >= PENDING_TILES_PER_WORKER * workers:
+                    pending.popleft().result()
+                    pbar.update(1)
 
-def process_data(input_path: Path, output_path: Path, small: bool) -> None:
+    while pending:
+        pending.popleft().result()
+        pbar.update(1)
+
+def process_data(input_path: Path, output_path: Path, small: bool, workers: Optional[int] = None,
+                 oxipng: bool = False) -> None:
     print(f"### Processing {input_path}")
 
     isbn_data = bencodepy.bread(zstandard.ZstdDecompressor().stream_reader(open(input_path, 'rb')))
     isbn_data = cast(OrderedDict, isbn_data)
 
-    processor = PILISBNsBinaryProcessor()
+    workers = workers or os.cpu_count() or 1
+    processor = NumpyISBNsBinaryProcessor(workers)
+
+    # PNG encoding is the slowest part, so tiles are saved in other threads
+    # with a bounded number of them in flight, Pillow releases the GIL while encoding
+    # so this overlaps without copying the tiles to other processes
+    executor = ThreadPoolExecutor(workers) if workers > 1 else None
+    save = partial(save_block, executor=executor, workers=workers, optimize=not oxipng)
 
     md5_blocks = {}
     all_blocks = defaultdict(processor.create_block)
 
-    print(f"### Processing md5")
-    for id, block in processor.process(isbn_data[b'md5']):
-        md5_blocks[id] = block
+    try:
+        print(f"### Processing md5")
+        for id, block in processor.process(isbn_data[b'md5']):
+            md5_blocks[id] = block
 
-        save_block(output_path / "md5", id, block)
+            save(output_path / "md5", id, block)
 
-    for set_name, packed_isbns_binary in isbn_data.items():
-        set_name = set_name.decode()
-        if set_name == 'md5':
-            continue
+        for set_name, packed_isbns_binary in isbn_data.items():
+            set_name = set_name.decode()
+            if set_name == 'md5':
+                continue
 
-        if small and set_name == 'edsebk':
-            break
+            if small and set_name == 'edsebk':
+                break
 
-        print(f"### Processing {set_name}")
-        for id, block in processor.process(packed_isbns_binary):
-            all_blocks[id] = ImageChops.logical_or(all_blocks[id], block)
+            print(f"### Processing {set_name}")
+            for id, block in processor.process(packed_isbns_binary):
+                all_blocks[id] |= block
 
-            block_in = ImageChops.logical_and(block, md5_blocks[id])
-            save_block(output_path / f"{set_name}_in", id, block_in)
+                block_in = block & md5_blocks[id]
+                save(output_path / f"{set_name}_in", id, block_in)
 
-            # block_out = ImageChops.logical_and(block, ImageChops.invert(md5_blocks[id]))
-            block_out = ImageChops.subtract(block, block_in)
-            save_block(output_path / f"{set_name}_out", id, block_out)
+                # block and not md5 in one pass, without an inverted copy of the md5 block
+                block_out = block > md5_blocks[id]
+                save(output_path / f"{set_name}_out", id, block_out)
 
-    print(f"### Processing all sets")
-    for id, block in all_blocks.items():
-        block_in = ImageChops.logical_and(block, md5_blocks[id])
-        save_block(output_path / f"all_in", id, block_in)
+        print(f"### Processing all sets")
+        for id, block in all_blocks.items():
+            block_in = block & md5_blocks[id]
+            save(output_path / f"all_in", id, block_in)
 
-        # block_out = ImageChops.logical_and(block, ImageChops.invert(md5_blocks[id]))
-        block_out = ImageChops.subtract(block, block_in)
-        save_block(output_path / f"all_out", id, block_out)
+            block_out = block > md5_blocks[id]
+            save(output_path / f"all_out", id, block_out)
+    finally:
+        processor.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if oxipng:
+        optimize_tiles(output_path)
 
     print(f"### Outputs written to {output_path}")
 
@@ -109,9 +160,14 @@ def main():
     parser.add_argument('input', type=Path, help='Input file path')
     parser.add_argument('output', type=Path, help='Output path')
     parser.add_argument("--small", action="store_true", help="For dev purposes, don't render all tiles")
+    parser.add_argument('--workers', type=int, help='Number of processes rendering blocks and threads encoding tiles (default: CPU count)')
+    parser.add_argument('--oxipng', action='store_true', help='Save tiles quickly and optimize them with oxipng afterwards')
     args = parser.parse_args()
 
-    process_data(args.input, args.output, args.small)
+    if args.oxipng and shutil.which('oxipng') is None:
+        parser.error("oxipng not found in PATH")
+
+    process_data(args.input, args.output, args.small, args.workers, args.oxipng)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
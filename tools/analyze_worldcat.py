@@ -1,9 +1,12 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
 from pathlib import Path
 from random import random
 from typing import Set, Iterator
 import json
 import io
+import queue
+import threading
+import time
 import zstandard
 import re
 from rich.live import Live
@@ -27,6 +30,35 @@ class CompressedByteTracker:
     def tell(self):
         return self.compressed_pos
 
+# large reads from the file and the decompressor, at the cost of a few MB per stream
+READ_SIZE = 1 << 20
+BUFFER_SIZE = 1 << 22
+PROGRESS_INTERVAL = 1000
+# batches of lines decompressed ahead of the parsing
+MAX_PENDING_BATCHES = 8
+# parsing str skips the encoding detection json.loads does for bytes
+decode_json = json.JSONDecoder().decode
+
+def read_line_batches(line_stream: io.BufferedReader, batches: queue.Queue, stop_event: threading.Event):
+    """Put lists of lines on the queue until the stream ends, then None"""
+    def put(item) -> bool:
+        # gives up once the consumer is gone, so the thread can always be joined
+        while not stop_event.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        while True:
+            lines = line_stream.readlines(READ_SIZE)
+            if not put(lines if lines else None) or not lines:
+                break
+    except Exception as e:
+        put(e)
+
 def read_zst_jsonl(filepath: Path, progress: Progress = None) -> Iterator[dict]:
     """Read a .jsonl.zst file line by line with a progress bar based on compressed file size."""
     total_size = filepath.stat().st_size
@@ -46,36 +78,57 @@ def read_zst_jsonl(filepath: Path, progress: Progress = None) -> Iterator[dict]:
         with open(filepath, 'rb') as fh:
             tracked_file = CompressedByteTracker(fh)
             dctx = zstandard.ZstdDecompressor()
-            stream_reader = dctx.stream_reader(tracked_file)
-            text_stream = io.TextIOWrapper(stream_reader, encoding='utf-8')
+            stream_reader = dctx.stream_reader(tracked_file, read_size=READ_SIZE)
+            # lines are kept as bytes until they are parsed
+            line_stream = io.BufferedReader(stream_reader, buffer_size=BUFFER_SIZE)
 
             if not external_progress:
                 progress.start()
 
-            counter = 0
-            while True:
-                try:
-                    line = text_stream.readline()
-                    if not line:
+            # decompress in another thread while the lines are parsed here,
+            # zstandard releases the GIL while it works
+            batches = queue.Queue(maxsize=MAX_PENDING_BATCHES)
+            stop_event = threading.Event()
+            reader = threading.Thread(target=read_line_batches, args=(line_stream, batches, stop_event), daemon=True)
+            reader.start()
+
+            try:
+                counter = 0
+                num_lines = 0
+                while True:
+                    lines = batches.get()
+                    if lines is None:
                         break
-
-                    # counter += 1
-                    # if counter % 40_073 > 30:
-                    #     continue
-
-                    if line.strip():  # Skip empty lines
-                        progress.update(task, completed=tracked_file.tell())
-
-                        yield json.loads(line)
-                except Exception as e:
-                    print(f"Error processing line: {e}")
-                    continue
+                    if isinstance(lines, Exception):
+                        raise lines
+
+                    for line in lines:
+                        try:
+                            # counter += 1
+                            # if counter % 40_073 > 30:
+                            #     continue
+
+                            if line.strip():  # Skip empty lines
+                                num_lines += 1
+                                if num_lines % PROGRESS_INTERVAL == 0:
+                                    progress.update(task, completed=tracked_file.tell())
+
+                                yield decode_json(line.decode('utf-8'))
+                        except Exception as e:
+                            print(f"Error processing line: {e}")
+                            continue
+                progress.update(task, completed=tracked_file.tell())
+            finally:
+                stop_event.set()
+                reader.join()
     finally:
         if not external_progress:
             progress.stop()
 
 
 
+YEAR_PATTERN = re.compile(r'\d{4}')
+
 def extract_most_likely_year(strings: list[str]) -> int | None:
     """
     Extract the most likely publication year from multiple strings using a tiered approach.
@@ -88,36 +141,39 @@ def extract_most_likely_year(strings: list[str]) -> int | None:
     """
     current_year = 2025
 
-    def find_years_in_range(strings, start_year, end_year):
-        years = []
-        pattern = r'\d{4}'
-        for text in strings:
-            matches = re.finditer(pattern, str(text))
-            for match in matches:
-                year = int(match.group())
-                if start_year <= year <= end_year:
-                    years.append(year)
-        return years
+    # find every 4 digit number once, the tiers only filter them
+    all_years = [int(match) for text in strings for match in YEAR_PATTERN.findall(str(text))]
+
+    def find_years_in_range(start_year, end_year):
+        return [year for year in all_years if start_year <= year <= end_year]
+
+    def most_common(years):
+        distinct = set(years)
+        if len(distinct) == 1:
+            return years[0]
+        # count once instead of a list.count per distinct year, picking among ties like before
+        counts = Counter(years)
+        return max(distinct, key=counts.__getitem__)
 
     # Tier 1: Check 1950-1999 first (most likely period)
-    years = find_years_in_range(strings, 1950, 1999)
+    years = find_years_in_range(1950, 1999)
     if years:
-        return max(set(years), key=years.count)  # Return most common year
+        return most_common(years)  # Return most common year
 
     # Tier 2: Try 1900-current
-    years = find_years_in_range(strings, 1900, current_year)
+    years = find_years_in_range(1900, current_year)
     if years:
-        return max(set(years), key=years.count)
+        return most_common(years)
 
     # Tier 3: Try 1800-current
-    years = find_years_in_range(strings, 1800, current_year)
+    years = find_years_in_range(1800, current_year)
     if years:
-        return max(set(years), key=years.count)
+        return most_common(years)
 
     # Tier 4: Last resort - try 1450-current
-    years = find_years_in_range(strings, 1450, current_year)
+    years = find_years_in_range(1450, current_year)
     if years:
-        return max(set(years), key=years.count)
+        return most_common(years)
 
     return None
 
@@ -125,9 +181,13 @@ curr_oclc_number = "0000000000000"
 data = {}
 END_YEAR = 2020
 table = defaultdict(lambda: [0 for i in range(10)])
+# kept up to date with the table so the display doesn't have to sum it up
+row_totals = defaultdict(int)
+totals = [0 for i in range(10)]
+REFRESH_PER_SECOND = 30
 
 
-def generate_table(data):
+def generate_table(data, row_totals, totals):
     # Create a fresh table each update
     table = Table()
 
@@ -141,12 +201,8 @@ def generate_table(data):
 
     table.add_column("Total", justify="right")
 
-    totals = [0 for i in range(10)]
     for year in sorted(data.keys()):
-        table.add_row("<1800" if year == 1790 else "N/A" if year == 9000 else str(year), *(str(n) if n > 0 else "" for n in data[year]), str(sum(data[year])))
-
-        for i in range(10):
-            totals[i] += data[year][i]
+        table.add_row("<1800" if year == 1790 else "N/A" if year == 9000 else str(year), *(str(n) if n > 0 else "" for n in data[year]), str(row_totals[year]))
 
     table.add_section()
     table.add_row("Total", *(str(n) if n > 0 else "" for n in totals), str(sum(totals)))
@@ -163,8 +219,10 @@ progress = Progress(
 
 console = Console()
 
-with Live(console=console, refresh_per_second=30) as live:
+with Live(console=console, refresh_per_second=REFRESH_PER_SECOND) as live:
     counter = 0
+    # the table is only rebuilt as often as the display refreshes
+    next_update = 0.0
     for record in read_zst_jsonl(input_filename, progress=progress):
         metadata = record.get('metadata')
         oclc_number = metadata.get('oclc_number')
@@ -202,23 +260,29 @@ with Live(console=console, refresh_per_second=30) as live:
                 count_bin = min(9, data['totalHoldingCount'] - 1)
                 if year:
                     year = max(1790, year)
-
-                    table[year // 10 * 10][count_bin] += 1
+                    row = year // 10 * 10
                 else:
-                    table[9000][count_bin] += 1
+                    row = 9000
+
+                table[row][count_bin] += 1
+                row_totals[row] += 1
+                totals[count_bin] += 1
 
                 counter += 1
 
-                if counter % 10 == 0:
+                now = time.monotonic()
+                if now >= next_update:
+                    next_update = now + 1 / REFRESH_PER_SECOND
                     # print()
                     # for year in sorted(table.keys()):
                     #     counts = table[year]
                     #     print(f"{year}\t{'\t'.join(str(x) for x in counts)}")
 
                     # Update the display
-                    live.update(Group(generate_table(table), progress))
+                    live.update(Group(generate_table(table, row_totals, totals), progress))
 
 
             curr_oclc_number = oclc_number
             data = {}
 
+    live.update(Group(generate_table(table, row_totals, totals), progress))
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 import argparse
+from bisect import bisect_right
+from itertools import accumulate
 import json
 import os
+import struct
 import sys
 from typing import Optional, Dict
 import zstandard as zstd
@@ -10,7 +13,15 @@ from rich.syntax import Syntax
 from rich.prompt import Prompt
 from rich.panel import Panel
 from rich.table import Table
-import io
+
+# large reads from the file and the decompressor, at the cost of a few MB
+READ_SIZE = 1 << 20
+
+# seekable zstd files end with a seek table listing the size of every frame,
+# followed by this footer: number of frames, descriptor, magic number
+SEEK_TABLE_FOOTER = struct.Struct('<IBI')
+SEEK_TABLE_MAGIC = 0x8F92EAB1
+SEEK_TABLE_CHECKSUM_FLAG = 0x80
 
 class JsonlBrowser:
     def __init__(self, filepath: str, cache_size: int = 1000):
@@ -19,22 +30,52 @@ class JsonlBrowser:
         self.current_position = 0
         self.cache_size = cache_size
         self.cache: Dict[int, dict] = {}
+        # one past the highest cached position, entries are cached in increasing position
+        self.next_pos = 0
+        # lowercased values of cached entries, filled in by searches
+        self.search_index: Dict[int, tuple[str, ...]] = {}
         self.file_size = os.path.getsize(self.filepath)
 
         # Open the file for reading
         self.fh = open(self.filepath, 'rb')
+        # where each frame starts, if the file has a seek table
+        self.frame_offsets = self._read_frame_offsets()
 
         # Initialize decompressor with seeking capabilities
         self.dctx = zstd.ZstdDecompressor()
-        self.reader = self.dctx.stream_reader(self.fh)
+        self.reader = self.dctx.stream_reader(self.fh, read_size=READ_SIZE)
 
         # Reset to start
         self.fh.seek(0)
-        self.buffer = io.StringIO()
+        # incomplete last line of what was read so far
+        self.tail = b''
 
         # Load initial entries into cache
         self._fill_cache()
 
+    def _read_frame_offsets(self) -> Optional[list[int]]:
+        """
+        Read the compressed offset of every frame from the seek table.
+        Returns None if the file doesn't have one.
+        """
+        if self.file_size < SEEK_TABLE_FOOTER.size:
+            return None
+
+        self.fh.seek(self.file_size - SEEK_TABLE_FOOTER.size)
+        num_frames, descriptor, magic = SEEK_TABLE_FOOTER.unpack(self.fh.read(SEEK_TABLE_FOOTER.size))
+        if magic != SEEK_TABLE_MAGIC or num_frames == 0:
+            return None
+
+        # each entry is the compressed size, decompressed size and optionally a checksum
+        entry = struct.Struct('<III' if descriptor & SEEK_TABLE_CHECKSUM_FLAG else '<II')
+        table_size = num_frames * entry.size
+        if table_size + SEEK_TABLE_FOOTER.size > self.file_size:
+            return None
+
+        self.fh.seek(self.file_size - SEEK_TABLE_FOOTER.size - table_size)
+        compressed_sizes = [fields[0] for fields in entry.iter_unpack(self.fh.read(table_size))]
+        return list(accumulate(compressed_sizes[:-1], initial=0))
+
     def _seek_to_percentage(self, percentage: float) -> Optional[int]:
         """
         Seek to approximate percentage position using zstd frame info.
@@ -46,30 +87,36 @@ class JsonlBrowser:
         target_byte = int((percentage / 100.0) * self.file_size)
 
         try:
-            # Seek to nearest frame boundary
-            self.fh.seek(target_byte)
-            # Find next frame header
-            while True:
-                chunk = self.fh.read(4096)
-                if not chunk:
-                    break
-
-                # Look for frame magic number (0xFD2FB528)
-                magic_pos = chunk.find(b'\x28\xB5\x2F\xFD')
-                if magic_pos != -1:
-                    # Seek back to frame start
-                    self.fh.seek(self.fh.tell() - len(chunk) + magic_pos)
-                    break
+            if self.frame_offsets is not None:
+                # Seek to the start of the frame containing the target
+                self.fh.seek(self.frame_offsets[bisect_right(self.frame_offsets, target_byte) - 1])
+            else:
+                # Seek to nearest frame boundary
+                self.fh.seek(target_byte)
+                # Find next frame header
+                while True:
+                    chunk = self.fh.read(4096)
+                    if not chunk:
+                        break
+
+                    # Look for frame magic number (0xFD2FB528)
+                    magic_pos = chunk.find(b'\x28\xB5\x2F\xFD')
+                    if magic_pos != -1:
+                        # Seek back to frame start
+                        self.fh.seek(self.fh.tell() - len(chunk) + magic_pos)
+                        break
 
             # Reset reader and cache at new position
-            self.reader = self.dctx.stream_reader(self.fh)
+            self.reader = self.dctx.stream_reader(self.fh, read_size=READ_SIZE)
             self.cache.clear()
-            self.buffer = io.StringIO()
+            self.search_index.clear()
+            self.next_pos = 0
+            self.tail = b''
 
             # Read one batch to establish new position
             self._fill_cache()
             if self.cache:
-                return min(self.cache.keys())
+                return next(iter(self.cache))
 
         except Exception as e:
             self.console.print(f"[red]Error during seek: {str(e)}[/red]")
@@ -80,27 +127,21 @@ class JsonlBrowser:
         """Fill cache with next batch of entries."""
         try:
             while len(self.cache) < self.cache_size:
-                chunk = self.reader.read(8192)
+                chunk = self.reader.read(READ_SIZE)
                 if not chunk:
                     break
 
-                text = chunk.decode('utf-8')
-                self.buffer.write(text)
-                self.buffer.seek(0)
-
-                lines = self.buffer.readlines()
-                if text and not text.endswith('\n'):
-                    last_line = lines.pop()
-                    self.buffer = io.StringIO(last_line)
-                else:
-                    self.buffer = io.StringIO()
+                # only the incomplete line is carried over, lines are parsed as bytes
+                lines = (self.tail + chunk).split(b'\n')
+                self.tail = lines.pop()
 
-                start_pos = max(self.cache.keys(), default=-1) + 1
+                start_pos = self.next_pos
                 for i, line in enumerate(lines):
                     if line.strip():
                         try:
                             entry = json.loads(line)
                             self.cache[start_pos + i] = entry
+                            self.next_pos = start_pos + i + 1
                         except json.JSONDecodeError:
                             self.console.print(f"[red]Error decoding JSON at position {start_pos + i}[/red]")
 
@@ -115,7 +156,7 @@ class JsonlBrowser:
         if position in self.cache:
             return self.cache[position]
 
-        if position > max(self.cache.keys(), default=-1):
+        if position >= self.next_pos:
             self._fill_cache()
             return self.cache.get(position)
 
@@ -148,10 +189,14 @@ class JsonlBrowser:
     def search(self, query: str):
         """Search for entries containing the query string."""
         results = []
+        query_lower = query.lower()
 
         # Search in cache
         for pos, entry in self.cache.items():
-            if any(query.lower() in str(v).lower() for v in entry.values()):
+            values = self.search_index.get(pos)
+            if values is None:
+                values = self.search_index[pos] = tuple(str(v).lower() for v in entry.values())
+            if any(query_lower in value for value in values):
                 results.append((pos, entry))
 
         if results:
@@ -224,7 +269,6 @@ class JsonlBrowser:
                     break
 
         finally:
-            self.buffer.close()
             self.reader.close()
             self.fh.close()
 